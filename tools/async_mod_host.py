@@ -0,0 +1,217 @@
+#
+
+import asyncio
+import collections
+import logging
+import socket
+import threading
+
+from util import ModHostFeedbackListener
+from util import encode_command
+from util import parse_response
+
+
+logger = logging.getLogger(__name__)
+
+
+# asyncio mod-host client
+
+class AsyncModHostConnection():
+
+  def __init__(self, host='localhost', port=5555, timeout=5):
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+
+    self.loop = None
+    self.reader = None
+    self.writer = None
+    self.read_task = None
+
+    # Futures for commands in flight, in the order they were written.
+    self.pending = collections.deque()
+
+
+  async def connect(self):
+    self.loop = asyncio.get_running_loop()
+    self.reader, self.writer = await asyncio.open_connection(
+        self.host, self.port)
+    self.read_task = self.loop.create_task(self.read_responses())
+    return self
+
+
+  async def close(self):
+    if self.read_task:
+      self.read_task.cancel()
+    if self.writer:
+      self.writer.close()
+      await self.writer.wait_closed()
+
+
+  async def read_responses(self):
+    try:
+      while True:
+        resp = await self.reader.readuntil(b'\x00')
+        logger.debug('resp: %s', resp)
+        if not self.pending:
+          logger.warning('Unexpected response from mod-host: %s', resp)
+          continue
+        future = self.pending.popleft()
+        # Commands that already timed out still own their slot in the queue,
+        # their late response is dropped here to keep the rest in step.
+        if future.done():
+          continue
+        try:
+          future.set_result(parse_response(resp[:-1]))
+        except (ValueError, UnicodeDecodeError) as e:
+          # Only this command failed, the reader carries on.
+          logger.error('Bad response from mod-host %r: %s', resp, e)
+          future.set_result(None)
+    except (asyncio.IncompleteReadError, ConnectionError) as e:
+      logger.error('Lost mod-host connection: %s', e)
+      while self.pending:
+        future = self.pending.popleft()
+        if not future.done():
+          future.set_exception(ConnectionError('mod-host connection lost'))
+
+
+  async def wait_for_response(self, future, timeout):
+    try:
+      return await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, ConnectionError) as e:
+      logger.warning('mod-host command failed: %s', str(e) or 'timed out')
+      return None
+
+
+  def send_command(self, command, timeout=None, encoding='utf-8'):
+    # The command is written immediately, the returned task resolves once its
+    # response arrives or its own timeout expires.
+    future = self.loop.create_future()
+    self.pending.append(future)
+    self.writer.write(encode_command(command, encoding))
+    logger.debug('sent: %s', command)
+    return self.loop.create_task(self.wait_for_response(
+        future,
+        self.timeout if timeout is None else timeout,
+        ))
+
+
+  def send_commands(self, commands, timeout=None, encoding='utf-8'):
+    tasks = [self.send_command(c, timeout, encoding) for c in commands]
+    return asyncio.gather(*tasks)
+
+
+  def add_plugin(self, plugin_uri, instance_number=0):
+    return self.send_command('add {} {}'.format(plugin_uri, instance_number))
+
+
+  def remove_plugin(self, instance_number):
+    return self.send_command('remove {}'.format(instance_number))
+
+
+  def remove_plugins(self, instance_numbers):
+    return self.send_commands(
+        'remove {}'.format(i) for i in instance_numbers)
+
+
+  def get_presets(self, URI):
+    return self.send_command('preset_show {}'.format(URI))
+
+
+  def get_param(self, instance_number, symbol):
+    return self.send_command('param_get {} {}'.format(instance_number, symbol))
+
+
+  def get_params(self, params):
+    # params: iterable of (instance_number, symbol).
+    return self.send_commands(
+        'param_get {} {}'.format(instance_number, symbol)
+        for instance_number, symbol in params)
+
+
+  def set_param(self, instance_number, symbol, value):
+    return self.send_command('param_set {} {} {}'.format(instance_number, symbol, value))
+
+
+  def set_params(self, params):
+    return self.send_commands(
+        'param_set {} {} {}'.format(instance_number, symbol, value)
+        for instance_number, symbol, value in params)
+
+
+# Bridge for the blocking UIs: runs the asyncio client on its own thread and
+# hands back concurrent.futures.Future objects instead of waiting on sockets.
+
+class ThreadedModHostConnection():
+
+  def __init__(self, host='localhost', port=5555, timeout=5):
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self.loop.run_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+    self.connection = AsyncModHostConnection(host, port, timeout)
+    self.call(self.connection.connect).result(timeout)
+
+    self.host = host
+    self.feedback_port = port + 1
+    self.feedback = None
+
+
+  def call(self, method, *args):
+    async def run():
+      return await method(*args)
+    return asyncio.run_coroutine_threadsafe(run(), self.loop)
+
+
+  def close(self):
+    self.call(self.connection.close).result()
+    self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+  def start_feedback_listener(self):
+    if not self.feedback:
+      feedback_socket = socket.create_connection(
+          (self.host, self.feedback_port), self.connection.timeout)
+      self.feedback = ModHostFeedbackListener(feedback_socket)
+    return self.feedback
+
+
+  def send_command(self, command):
+    return self.call(self.connection.send_command, command)
+
+
+  def send_commands(self, commands):
+    return self.call(self.connection.send_commands, list(commands))
+
+
+  def add_plugin(self, plugin_uri, instance_number=0):
+    return self.call(self.connection.add_plugin, plugin_uri, instance_number)
+
+
+  def remove_plugin(self, instance_number):
+    return self.call(self.connection.remove_plugin, instance_number)
+
+
+  def remove_plugins(self, instance_numbers):
+    return self.call(self.connection.remove_plugins, list(instance_numbers))
+
+
+  def get_presets(self, URI):
+    return self.call(self.connection.get_presets, URI)
+
+
+  def get_param(self, instance_number, symbol):
+    return self.call(self.connection.get_param, instance_number, symbol)
+
+
+  def get_params(self, params):
+    return self.call(self.connection.get_params, list(params))
+
+
+  def set_param(self, instance_number, symbol, value):
+    return self.call(self.connection.set_param, instance_number, symbol, value)
+
+
+  def set_params(self, params):
+    return self.call(self.connection.set_params, list(params))
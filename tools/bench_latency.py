@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import math
+import threading
+
+import numpy
+
+import jack
+
+from stats import percentile
+from util import get_jack_client
+
+
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+
+# States of LatencyProbe.
+IDLE = 'idle'
+WAITING = 'waiting'
+RELEASING = 'releasing'
+
+# Above this, a sample counts as the note's onset.
+DEFAULT_THRESHOLD = 0.01
+# Gives up on a note that doesn't sound within this.
+DEFAULT_TIMEOUT_SECONDS = 1.0
+# Quiet needed after a note off before the next note on.
+DEFAULT_SILENCE_SECONDS = 0.05
+# Release tails longer than this are cut short.
+DEFAULT_MAX_RELEASE_SECONDS = 2.0
+
+
+class LatencyProbe():
+  # Plays notes into a plugin's MIDI input and watches its audio outputs,
+  # both from the same JACK process callback, so a note's latency is the
+  # frame its sound starts at minus the frame its note on was written at.
+  # Note ons go out at a different offset into each cycle, so plugins that
+  # ignore event offsets show up as jitter of about a period.
+  #
+  # The plugin's audio comes back to this client, which JACK can only do a
+  # cycle late: numbers include one period that the plugin's route to
+  # system:playback doesn't have.
+
+  def __init__(
+      self,
+      target,
+      note=60,
+      velocity=100,
+      threshold=DEFAULT_THRESHOLD,
+      timeout=DEFAULT_TIMEOUT_SECONDS,
+      silence=DEFAULT_SILENCE_SECONDS,
+      max_release=DEFAULT_MAX_RELEASE_SECONDS,
+      ):
+    # target: JACK client name of the plugin, e.g. effect_0.
+    self.target = target
+    self.note = note
+    self.velocity = velocity
+    self.threshold = threshold
+
+    # Ports can only be registered, and callbacks set, before activating.
+    self.client = get_jack_client('lilt_latency', activate=False)
+    self.midi_out = self.client.midi_outports.register('midi_out')
+    self.audio_ins = [
+        self.client.inports.register('in_{}'.format(n)) for n in [1, 2]]
+    self.client.set_process_callback(self.process)
+
+    self.timeout = timeout
+    self.silence = silence
+    self.max_release = max_release
+
+    self.lock = threading.Lock()
+    self.reset(0)
+
+
+  def reset(self, count):
+    with self.lock:
+      self.remaining = count
+      self.latencies = []
+      self.missed = 0
+      self.state = IDLE
+      # Frame the current state started at, None until the next cycle.
+      self.state_frame = None
+      self.note_frame = None
+      self.quiet_frames = 0
+      self.done = threading.Event()
+      if not count:
+        self.done.set()
+
+
+  def start(self):
+    self.client.activate()
+
+    midi_ins = self.client.get_ports(
+        '^' + self.target + ':', is_midi=True, is_input=True)
+    audio_outs = self.client.get_ports(
+        '^' + self.target + ':', is_audio=True, is_output=True)
+    if not midi_ins or not audio_outs:
+      raise Exception('No MIDI input or audio output on {}'.format(self.target))
+    # Like routing.Router, the first MIDI input and first and last outputs.
+    self.client.connect(self.midi_out, midi_ins[0])
+    self.client.connect(audio_outs[0], self.audio_ins[0])
+    self.client.connect(audio_outs[-1], self.audio_ins[1])
+    return self
+
+
+  def stop(self):
+    self.client.deactivate()
+    self.client.close()
+
+
+  def set_blocksize(self, blocksize):
+    # Changes it for the whole JACK server, every client included.
+    if self.client.blocksize != blocksize:
+      self.client.blocksize = blocksize
+
+
+  def get_playback_latency(self):
+    # What JACK says the hardware adds after the graph, in frames.
+    ports = self.client.get_ports(
+        'system:playback_', is_audio=True, is_input=True)
+    if not ports:
+      return None
+    return ports[0].get_latency_range(jack.PLAYBACK)[1]
+
+
+  def measure(self, count):
+    # Plays count notes, one after another. Returns (latencies, missed),
+    # latencies in frames.
+    self.reset(count)
+    self.done.wait()
+    with self.lock:
+      return list(self.latencies), self.missed
+
+
+  def find_onset(self):
+    # Index of the first loud sample of this cycle, or None.
+    onset = None
+    for port in self.audio_ins:
+      loud = numpy.flatnonzero(numpy.abs(port.get_array()) > self.threshold)
+      if loud.size and (onset is None or loud[0] < onset):
+        onset = loud[0]
+    return onset
+
+
+  def process(self, frames):
+    self.midi_out.clear_buffer()
+    now = self.client.last_frame_time
+    rate = self.client.samplerate
+
+    with self.lock:
+      if self.state_frame is None:
+        self.state_frame = now
+
+      if self.state == IDLE:
+        if self.remaining <= 0:
+          return
+        # Somewhere else in the cycle every time, but not at its very end.
+        offset = (self.remaining * 97) % max(1, frames - 1)
+        self.midi_out.write_midi_event(
+            offset, (NOTE_ON, self.note, self.velocity))
+        self.note_frame = now + offset
+        self.set_state(WAITING, now)
+
+      elif self.state == WAITING:
+        onset = self.find_onset()
+        if onset is not None and now + onset >= self.note_frame:
+          self.latencies.append(now + onset - self.note_frame)
+          self.release(now)
+        elif now - self.note_frame > self.timeout * rate:
+          self.missed += 1
+          self.release(now)
+
+      elif self.state == RELEASING:
+        # Next note once the tail has died down.
+        if self.find_onset() is None:
+          self.quiet_frames += frames
+        else:
+          self.quiet_frames = 0
+        if (self.quiet_frames >= self.silence * rate
+            or now - self.state_frame > self.max_release * rate):
+          self.remaining -= 1
+          self.set_state(IDLE, now)
+          if self.remaining <= 0:
+            self.done.set()
+
+
+  def release(self, now):
+    self.midi_out.write_midi_event(0, (NOTE_OFF, self.note, 0))
+    self.quiet_frames = 0
+    self.set_state(RELEASING, now)
+
+
+  def set_state(self, state, now):
+    self.state = state
+    self.state_frame = now
+
+
+def print_histogram(latencies_ms, bin_ms, width=40):
+  if not latencies_ms:
+    return
+  first = int(math.floor(min(latencies_ms) / bin_ms))
+  last = int(math.floor(max(latencies_ms) / bin_ms))
+  counts = [0] * (last - first + 1)
+  for latency in latencies_ms:
+    counts[int(math.floor(latency / bin_ms)) - first] += 1
+  for n, count in enumerate(counts):
+    bar = '#' * int(math.ceil(float(count) * width / max(counts)))
+    print('  {:>7.2f} ms {:>5} |{}'.format((first + n) * bin_ms, count, bar))
+
+
+def report(probe, latencies, missed, bin_ms):
+  rate = float(probe.client.samplerate)
+  blocksize = probe.client.blocksize
+  latencies_ms = [1000 * latency / rate for latency in latencies]
+  print('blocksize {} ({:.2f} ms at {} Hz): {} notes, {} missed'.format(
+      blocksize, 1000 * blocksize / rate, int(rate),
+      len(latencies) + missed, missed))
+  if not latencies_ms:
+    return
+  mean = sum(latencies_ms) / len(latencies_ms)
+  jitter = math.sqrt(
+      sum((l - mean) ** 2 for l in latencies_ms) / len(latencies_ms))
+  print('  min {:.2f} ms  p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms  '
+        'jitter {:.3f} ms'.format(
+            min(latencies_ms),
+            percentile(latencies_ms, 50),
+            percentile(latencies_ms, 99),
+            max(latencies_ms),
+            jitter,
+            ))
+  playback = probe.get_playback_latency()
+  if playback is not None:
+    print('  + {:.2f} ms playback latency reported by system:playback'.format(
+        1000 * playback / rate))
+  print_histogram(latencies_ms, bin_ms)
+
+
+def bench_latency(target, blocksizes, count, note, velocity, threshold, bin_ms):
+  probe = LatencyProbe(target, note, velocity, threshold).start()
+  original_blocksize = probe.client.blocksize
+  try:
+    for blocksize in blocksizes or [original_blocksize]:
+      probe.set_blocksize(blocksize)
+      latencies, missed = probe.measure(count)
+      report(probe, latencies, missed, bin_ms)
+  finally:
+    probe.set_blocksize(original_blocksize)
+    probe.stop()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Measure MIDI to audio latency through a mod-host plugin')
+  parser.add_argument('-t', '--target', default='effect_0',
+                      help='JACK client of the plugin to play')
+  parser.add_argument('-b', '--blocksizes', default='',
+                      help='comma separated buffer sizes to try, e.g. '
+                      '128,256,512, the server\'s own if not given')
+  parser.add_argument('-n', '--count', default=100, type=int,
+                      help='notes per buffer size')
+  parser.add_argument('--note', default=60, type=int)
+  parser.add_argument('--velocity', default=100, type=int)
+  parser.add_argument('--threshold', default=DEFAULT_THRESHOLD, type=float,
+                      help='sample level that counts as sound')
+  parser.add_argument('--bin_ms', default=0.5, type=float,
+                      help='histogram bin width')
+  args = parser.parse_args()
+
+  bench_latency(
+      args.target,
+      [int(b) for b in args.blocksizes.split(',') if b],
+      args.count,
+      args.note,
+      args.velocity,
+      args.threshold,
+      args.bin_ms,
+      )
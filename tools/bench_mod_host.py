@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import time
+
+from async_mod_host import AsyncModHostConnection
+from fake_mod_host import FakeModHost
+from model import Model
+from stats import percentile
+from util import ModHostConnection
+
+
+PLUGIN_URI = 'http://drobilla.net/plugins/mda/DX10'
+
+
+def report(name, count, elapsed, latencies=None):
+  line = '{:<28} {:>10.0f} cmd/s'.format(name, count / elapsed)
+  if latencies:
+    line += '  p50 {:>8.3f} ms  p99 {:>8.3f} ms'.format(
+        1000 * percentile(latencies, 50),
+        1000 * percentile(latencies, 99),
+        )
+  print(line)
+
+
+def bench_send_command(mod_host, count):
+  latencies = []
+  start = time.time()
+  for i in range(count):
+    t = time.time()
+    mod_host.send_command('param_set 0 gain {}'.format(i))
+    latencies.append(time.time() - t)
+  report('send_command', count, time.time() - start, latencies)
+
+
+def bench_send_commands(mod_host, count, batch_size):
+  latencies = []
+  start = time.time()
+  for b in range(count // batch_size):
+    t = time.time()
+    mod_host.send_commands(
+        'param_set 0 gain {}'.format(i) for i in range(batch_size))
+    latencies.append(time.time() - t)
+  report(
+      'send_commands (batch {})'.format(batch_size),
+      count // batch_size * batch_size,
+      time.time() - start,
+      latencies,
+      )
+
+
+def bench_async(host, port, count):
+  async def run():
+    connection = await AsyncModHostConnection(host, port).connect()
+    start = time.time()
+    await connection.send_commands(
+        'param_set 0 gain {}'.format(i) for i in range(count))
+    elapsed = time.time() - start
+    await connection.close()
+    return elapsed
+
+  report('async, all in flight', count, asyncio.run(run()))
+
+
+def bench_model(model, count, slots):
+  latencies = []
+  for n in range(count):
+    t = time.time()
+    model.add_module(PLUGIN_URI, n % slots)
+    latencies.append(time.time() - t)
+  print('{:<28} mean {:>7.3f} ms  p50 {:>7.3f} ms  p99 {:>7.3f} ms'.format(
+      'Model.add_module',
+      1000 * sum(latencies) / len(latencies),
+      1000 * percentile(latencies, 50),
+      1000 * percentile(latencies, 99),
+      ))
+
+  latencies = []
+  for n in range(count):
+    for i in range(slots):
+      model.plugins_slots[i] = PLUGIN_URI
+    t = time.time()
+    model.clear_modules()
+    latencies.append(time.time() - t)
+  print('{:<28} mean {:>7.3f} ms  p50 {:>7.3f} ms  p99 {:>7.3f} ms'.format(
+      'Model.clear_modules ({})'.format(slots),
+      1000 * sum(latencies) / len(latencies),
+      1000 * percentile(latencies, 50),
+      1000 * percentile(latencies, 99),
+      ))
+
+
+def bench(host, port, feedback_port, count, batch_size, slots):
+  mod_host = ModHostConnection(host, port, feedback_port)
+  mod_host.add_plugin(PLUGIN_URI, 0)
+
+  bench_send_command(mod_host, count)
+  bench_send_commands(mod_host, count, batch_size)
+  bench_async(host, port, count)
+
+  model = Model(mod_host=mod_host, plugins=([], {}), use_jack=False)
+  bench_model(model, count // 10, slots)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Benchmark the mod-host control path')
+  parser.add_argument('--host', default='localhost')
+  parser.add_argument('-p', '--port', default=15555, type=int)
+  parser.add_argument('-f', '--feedback_port', default=15556, type=int)
+  parser.add_argument('-d', '--delay', default=0.0, type=float,
+                      help='response delay of the fake mod-host, in seconds')
+  parser.add_argument('-n', '--count', default=2000, type=int)
+  parser.add_argument('-b', '--batch_size', default=30, type=int)
+  parser.add_argument('-s', '--slots', default=8, type=int)
+  parser.add_argument('--external', action='store_true',
+                      help='benchmark an already running (fake) mod-host')
+  args = parser.parse_args()
+
+  fake_mod_host = None
+  if not args.external:
+    fake_mod_host = FakeModHost(
+        args.host, args.port, args.feedback_port, args.delay).start()
+
+  try:
+    bench(
+        args.host,
+        args.port,
+        args.feedback_port,
+        args.count,
+        args.batch_size,
+        args.slots,
+        )
+  finally:
+    if fake_mod_host:
+      fake_mod_host.stop()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import random
+import socket
+import time
+
+from model import Model
+from scenes import DEFAULT_SCENES_PATH
+from scenes import SceneStore
+from scenes import normalize_scene
+from supervisor import MAX_BACKOFF_SECONDS
+from supervisor import MIN_BACKOFF_SECONDS
+from util import ModHostConnection
+
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+
+# Picked from at random when no rack is given.
+DEMO_PATCHES = [
+    'http://magnus.smartelectronix.com/lv2/synth/qin',
+    'http://drobilla.net/plugins/mda/Piano',
+    'http://drobilla.net/plugins/mda/EPiano',
+    'http://drobilla.net/plugins/mda/DX10',
+    'http://drobilla.net/plugins/mda/JX10',
+    ]
+
+DEFAULT_TIMEOUT_SECONDS = 60
+
+
+def wait_until(probe, what, timeout):
+  # Calls probe() with backoff until it returns something other than None.
+  deadline = time.time() + timeout
+  backoff = MIN_BACKOFF_SECONDS
+  while True:
+    result = probe()
+    if result is not None:
+      return result
+    if time.time() > deadline:
+      raise Exception('Gave up waiting for {}'.format(what))
+    logger.debug('Waiting for %s', what)
+    time.sleep(backoff)
+    backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+
+def probe_mod_host(host, port, feedback_port):
+  # mod-host only listens once it's up, so a connection is the probe.
+  try:
+    return ModHostConnection(host, port, feedback_port)
+  except socket.error:
+    return None
+
+
+def probe_jack():
+  # Don't let the probe start a JACK server of its own.
+  import jack
+  try:
+    client = jack.Client('lilt_probe', no_start_server=True)
+  except jack.JackError:
+    return None
+  client.close()
+  return True
+
+
+def probe_midi_out(model, midi_out):
+  return True if model.port_registry.get_ports(
+      midi_out, is_midi=True, is_output=True) else None
+
+
+def get_demo_scene(url=None):
+  return {
+      'slots': {0: {'url': url or random.choice(DEMO_PATCHES), 'params': {}}},
+      'connections': [],
+      }
+
+
+def load_rack_file(path):
+  # A scene as written by SceneStore, params may be left out.
+  with open(path) as f:
+    return normalize_scene(json.load(f))
+
+
+def boot_rack(
+    scene,
+    host='localhost',
+    port=5555,
+    feedback_port=5556,
+    midi_out='',
+    timeout=DEFAULT_TIMEOUT_SECONDS,
+    midi_timeout=0,
+    ):
+  start = time.time()
+
+  mod_host = wait_until(
+      lambda: probe_mod_host(host, port, feedback_port), 'mod-host', timeout)
+  wait_until(probe_jack, 'JACK', timeout)
+  logger.info('mod-host and JACK up after %.1f s', time.time() - start)
+
+  # Nothing to gain from scanning plugins here, params come from the scene.
+  model = Model(
+      mod_host=mod_host,
+      plugins=([], {}),
+      supervise=False,
+      midi_out=midi_out,
+      )
+
+  if midi_out and midi_timeout:
+    try:
+      wait_until(
+          lambda: probe_midi_out(model, midi_out),
+          'MIDI source {}'.format(midi_out),
+          midi_timeout)
+    except Exception as e:
+      # Still worth making a sound, the MIDI source can be routed later.
+      logger.warning(e)
+
+  model.recall_scene(scene)
+  logger.info('Rack loaded after %.1f s', time.time() - start)
+  return model
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Load a rack into mod-host and route it, e.g. at boot')
+  parser.add_argument('--host', default='localhost')
+  parser.add_argument('-p', '--port', default=5555, type=int)
+  parser.add_argument('-f', '--feedback_port', default=5556, type=int)
+  group = parser.add_mutually_exclusive_group()
+  group.add_argument('-r', '--rack', help='JSON file with a scene to load')
+  group.add_argument('-s', '--scene', help='name of a saved scene to load')
+  group.add_argument('-u', '--url', help='a single plugin to load')
+  parser.add_argument('--scenes_path', default=DEFAULT_SCENES_PATH)
+  parser.add_argument('-m', '--midi_out', default='',
+                      help='name pattern of the MIDI sources to play from')
+  parser.add_argument('-t', '--timeout', default=DEFAULT_TIMEOUT_SECONDS,
+                      type=float,
+                      help='seconds to wait for mod-host and JACK')
+  parser.add_argument('--midi_timeout', default=10, type=float,
+                      help='seconds to wait for the MIDI source to show up')
+  parser.add_argument('--debug', action='store_true')
+  args = parser.parse_args()
+
+  logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
+  logging.getLogger('model').setLevel(logging.INFO)
+
+  if args.rack:
+    scene = load_rack_file(args.rack)
+  elif args.scene:
+    scene = SceneStore(args.scenes_path).load(args.scene)
+    if scene is None:
+      parser.error('No scene named {}'.format(args.scene))
+  else:
+    # Like demo.sh did, one of the demo patches at random.
+    scene = get_demo_scene(args.url)
+
+  boot_rack(
+      scene,
+      host=args.host,
+      port=args.port,
+      feedback_port=args.feedback_port,
+      midi_out=args.midi_out,
+      timeout=args.timeout,
+      midi_timeout=args.midi_timeout,
+      )
@@ -0,0 +1,332 @@
+#
+
+from array import array
+import collections
+import json
+import logging
+import math
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+LINEAR = 'linear'
+# Moves quickly at the start of the knob's travel, then slows down.
+LOG = 'log'
+# Moves slowly at the start, e.g. for frequencies and times.
+EXP = 'exp'
+
+# How strongly LOG and EXP bend.
+CURVE_FACTOR = 4.0
+
+CC_STEPS = 128
+CC14_STEPS = 16384
+
+# Knobs 1 to 4, mapped onto a plugin's first four params by default.
+DEFAULT_FIRST_CONTROL = 16
+DEFAULT_CONTROLS = 4
+
+MAPPINGS_VERSION = 1
+
+# mod-host's own MIDI mapping listens to one channel per param, mappings
+# for any channel use this one there.
+NATIVE_ANY_CHANNEL = 0
+
+DEFAULT_MAPPINGS_PATH = os.path.join(
+    os.getenv('XDG_CONFIG_HOME', '~/.config'), 'lil-t', 'cc_mappings.json')
+
+
+# One controller driving one param.
+# channel: MIDI channel, None for any.
+# min_val, max_val: the part of the param's range the knob covers.
+# high_res: 14-bit, control (0-31) carries the MSB and control + 32 the LSB.
+CcMapping = collections.namedtuple(
+    'CcMapping',
+    [
+        'channel',
+        'control',
+        'symbol',
+        'min_val',
+        'max_val',
+        'curve',
+        'invert',
+        'high_res',
+        ],
+    )
+
+
+def shape(fraction, curve):
+  if curve == LOG:
+    return math.log1p(CURVE_FACTOR * fraction) / math.log1p(CURVE_FACTOR)
+  elif curve == EXP:
+    return math.expm1(CURVE_FACTOR * fraction) / math.expm1(CURVE_FACTOR)
+  return fraction
+
+
+def build_table(min_val, max_val, curve=LINEAR, invert=False, steps=CC_STEPS):
+  # Param value for every controller value, so mapping is a single lookup.
+  table = array('d', [0.0] * steps)
+  for n in range(steps):
+    fraction = n / float(steps - 1)
+    if invert:
+      fraction = 1.0 - fraction
+    table[n] = min_val + (max_val - min_val) * shape(fraction, curve)
+  return table
+
+
+def clamp_mapping(mapping, min_val, max_val):
+  # Keeps a stored mapping within the port's (possibly changed) range.
+  return mapping._replace(
+      min_val=min(max(mapping.min_val, min_val), max_val),
+      max_val=min(max(mapping.max_val, min_val), max_val),
+      )
+
+
+def replace_mapping(mappings, mapping):
+  # Drops whatever the new mapping's control or param was mapped to.
+  return [
+      m for m in mappings
+      if m.symbol != mapping.symbol
+      and not (m.control == mapping.control
+               and m.channel in [None, mapping.channel])
+      ] + [mapping]
+
+
+def can_map_natively(mapping):
+  # mod-host's midi_map only scales 7-bit controllers linearly.
+  return (
+      mapping.curve == LINEAR
+      and not mapping.invert
+      and not mapping.high_res)
+
+
+def format_midi_map(instance, mapping):
+  channel = NATIVE_ANY_CHANNEL if mapping.channel is None else mapping.channel
+  return 'midi_map {} {} {} {} {} {}'.format(
+      instance, mapping.symbol, channel, mapping.control,
+      mapping.min_val, mapping.max_val)
+
+
+def format_midi_unmap(instance, symbol):
+  return 'midi_unmap {} {}'.format(instance, symbol)
+
+
+def format_midi_learn(instance, symbol, min_val, max_val):
+  return 'midi_learn {} {} {} {}'.format(instance, symbol, min_val, max_val)
+
+
+def get_default_mappings(symbols):
+  # symbols: a SymbolTable. Knobs 1 to 4 onto the first four params.
+  return [
+      CcMapping(
+          channel=None,
+          control=DEFAULT_FIRST_CONTROL + n,
+          symbol=symbols.symbols[n],
+          min_val=symbols.mins[n],
+          max_val=symbols.maxs[n],
+          curve=LINEAR,
+          invert=False,
+          high_res=False,
+          )
+      for n in range(min(DEFAULT_CONTROLS, len(symbols)))
+      ]
+
+
+class CcMappingStore():
+  # Learned mappings per plugin URL, in one JSON file.
+
+  def __init__(self, path=DEFAULT_MAPPINGS_PATH):
+    self.path = os.path.expanduser(path)
+    self.lock = threading.Lock()
+    # {url: [CcMapping]}, read on first use.
+    self.mappings = None
+
+
+  def read(self):
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (IOError, OSError, ValueError):
+      return {}
+    if data.get('version') != MAPPINGS_VERSION:
+      return {}
+    return dict(
+        (url, [CcMapping(*fields) for fields in mappings])
+        for url, mappings in data.get('plugins', {}).items())
+
+
+  def write(self):
+    mappings_dir = os.path.dirname(self.path)
+    if not os.path.isdir(mappings_dir):
+      os.makedirs(mappings_dir)
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(
+          {
+              'version': MAPPINGS_VERSION,
+              'plugins': dict(
+                  (url, [list(m) for m in mappings])
+                  for url, mappings in self.mappings.items()),
+              },
+          f,
+          separators=(',', ':'),
+          sort_keys=True,
+          )
+    os.rename(tmp_path, self.path)
+
+
+  def load(self, url):
+    # None if nothing was ever learned for the plugin.
+    with self.lock:
+      if self.mappings is None:
+        self.mappings = self.read()
+      return self.mappings.get(url)
+
+
+  def save(self, url, mappings):
+    with self.lock:
+      if self.mappings is None:
+        self.mappings = self.read()
+      self.mappings[url] = list(mappings)
+      try:
+        self.write()
+      except (IOError, OSError) as e:
+        logger.warning('Couldn\'t write CC mappings: %s', e)
+
+
+class CcMapper():
+  # Turns control changes into param writes through lookup tables built
+  # when mappings are set, so a CC costs a dict lookup, an array lookup and
+  # a write_param(slot, symbol, value) call, e.g. Model.queue_param.
+
+  def __init__(self, write_param):
+    self.write_param = write_param
+
+    self.lock = threading.Lock()
+    # {slot: ([CcMapping], SymbolTable)}
+    self.slots = {}
+    # {control: [(channel, slot, symbol, table, part)]}
+    self.tables = {}
+    # {(channel, control): last MSB} of 14-bit controllers.
+    self.msbs = {}
+    # (slot, symbol, callback) while learning.
+    self.learning = None
+
+
+  def set_slot(self, slot, mappings, symbols):
+    # symbols: the slot's SymbolTable, mappings of unknown params are
+    # skipped and the rest clamped to their port's range.
+    with self.lock:
+      self.slots[slot] = (list(mappings), symbols)
+      self.build_tables()
+
+
+  def clear_slot(self, slot):
+    with self.lock:
+      if self.slots.pop(slot, None) is not None:
+        self.build_tables()
+
+
+  def get_mappings(self, slot):
+    with self.lock:
+      return list(self.slots.get(slot, ([], None))[0])
+
+
+  def build_tables(self):
+    tables = collections.defaultdict(list)
+    for slot, (mappings, symbols) in sorted(self.slots.items()):
+      for mapping in mappings:
+        if mapping.symbol not in symbols.index:
+          logger.debug('No param %s to map in slot %s', mapping.symbol, slot)
+          continue
+        i = symbols.get_index(mapping.symbol)
+        mapping = clamp_mapping(mapping, symbols.mins[i], symbols.maxs[i])
+        table = build_table(
+            mapping.min_val,
+            mapping.max_val,
+            mapping.curve,
+            mapping.invert,
+            CC14_STEPS if mapping.high_res else CC_STEPS,
+            )
+        if mapping.high_res:
+          tables[mapping.control].append(
+              (mapping.channel, slot, mapping.symbol, table, 'msb'))
+          tables[mapping.control + 32].append(
+              (mapping.channel, slot, mapping.symbol, table, 'lsb'))
+        else:
+          tables[mapping.control].append(
+              (mapping.channel, slot, mapping.symbol, table, None))
+    # Swapped in whole, on_message() reads it without the lock.
+    self.tables = dict(tables)
+
+
+  def on_message(self, message, slot=None):
+    # Returns the (slot, symbol, value) writes made for it. With slot, only
+    # that slot's params are played, e.g. the one on screen.
+    if message.type != 'control_change':
+      return []
+    if self.learning:
+      self.learn_from(message)
+      return []
+
+    writes = []
+    channel, control, value = message.channel, message.control, message.value
+    for entry_channel, entry_slot, symbol, table, part in self.tables.get(
+        control, ()):
+      if entry_channel is not None and entry_channel != channel:
+        continue
+      if slot is not None and entry_slot != slot:
+        continue
+      if part == 'msb':
+        self.msbs[(channel, control)] = value
+        index = value << 7
+      elif part == 'lsb':
+        index = (self.msbs.get((channel, control - 32), 0) << 7) | value
+      else:
+        index = value
+      param_value = table[index]
+      self.write_param(entry_slot, symbol, param_value)
+      writes.append((entry_slot, symbol, param_value))
+    return writes
+
+
+  def learn(self, slot, symbol, callback=None):
+    # The next control change gets mapped onto the slot's param, replacing
+    # whatever that control or param was mapped to. callback(slot, mappings)
+    # is called with the slot's new mappings, e.g. to store them.
+    self.learning = (slot, symbol, callback)
+
+
+  def cancel_learn(self):
+    self.learning = None
+
+
+  def learn_from(self, message):
+    slot, symbol, callback = self.learning
+    self.learning = None
+
+    with self.lock:
+      mappings, symbols = self.slots.get(slot, ([], None))
+      if symbols is None or symbol not in symbols.index:
+        logger.warning('Can\'t learn %s for slot %s', symbol, slot)
+        return
+      i = symbols.get_index(symbol)
+      mapping = CcMapping(
+          channel=message.channel,
+          control=message.control,
+          symbol=symbol,
+          min_val=symbols.mins[i],
+          max_val=symbols.maxs[i],
+          curve=LINEAR,
+          invert=False,
+          high_res=False,
+          )
+      mappings = replace_mapping(mappings, mapping)
+      self.slots[slot] = (mappings, symbols)
+      self.build_tables()
+
+    logger.info('Learned CC %s for %s in slot %s', message.control, symbol, slot)
+    if callback:
+      callback(slot, mappings)
@@ -4,21 +4,26 @@ from __future__ import print_function
 
 import argparse
 import logging
-import socket
 from time import sleep
 
 import Image
 import ImageDraw
 import ImageFont
 
-from lilv import World
-from lilv import Plugin
-from lilv import Instance
-
 import mido
 
 import jack
 
+from cc_mapping import LINEAR
+from cc_mapping import CcMapper
+from cc_mapping import CcMapping
+from midi_dispatch import MidiDispatcher
+from param_coalescer import ParamCoalescer
+from plugin_cache import load_plugins
+from routing import Router
+from symbol_table import SymbolTable
+from util import ModHostConnection
+
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -63,29 +68,27 @@ DEFAULT_PLUGIN = 'http://drobilla.net/plugins/mda/DX10'
 class Mod():
 
   def __init__(self):
-    self.to_modhost_socket = self.open_socket(port=5555)
-    self.from_modhost_socket = self.open_socket(port=5556)
-
-    self.plugin_map = {}
+    # Locked, so the param writer and MIDI threads can share it.
+    self.mod_host = ModHostConnection()
 
-    world = World()
-    world.load_all()
-    self.plugins = world.get_all_plugins()
-
-    # Pre-load info about all known plugins.
-    for plugin in self.plugins:
-      if self.is_midi_plugin(plugin):
-        uri = plugin.get_uri()
-        self.plugin_map[str(uri)] = plugin
+    # Info about all known plugins, from the shared on-disk cache.
+    self.plugins, self.plugin_map = load_plugins()
 
     self.active_plugin = None
 
-    # setup handler for all incoming MIDI messages.
+    self.param_writes = ParamCoalescer(self.set_params)
+    # Knobs to params through lookup tables, rebuilt by map_knobs().
+    self.cc_mapper = CcMapper(self.param_writes.set_param)
+    self.symbols = None
+
+    # setup handler for all incoming MIDI messages, run off the input thread.
+    self.midi_dispatcher = MidiDispatcher(self.on_midi_event)
     midi_output_names = mido.get_input_names()
     for midi_output_name in midi_output_names:
       input_port = mido.open_input(
           midi_output_name,
-          callback=lambda message:self.on_midi_event(midi_output_name, message),
+          callback=lambda message, name=midi_output_name: (
+              self.midi_dispatcher.put(name, message)),
           )
 
     self.knob_mapping = {
@@ -99,48 +102,52 @@ class Mod():
     # self.state = 'knobs'
 
 
-  def is_midi_plugin(self, plugin):
-    for p in range(plugin.get_num_ports()):
-      port = plugin.get_port(p)
-      if self.is_midi_port(port):
-        return True
-    return False
-
-
-  def is_midi_port(self, port):
-    classes = [str(c) for c in port.get_classes()]
-    if ('http://lv2plug.in/ns/lv2core#InputPort' in classes
-        and 'http://lv2plug.in/ns/ext/atom#AtomPort' in classes):
-      return True
-    return False
-
-
   def remove_plugin(self, number):
-    self.send_command('remove {}'.format(number))
+    self.mod_host.remove_plugin(number)
 
 
   def add_plugin(self, number, plugin_uri):
-    self.send_command('add {} {}'.format(plugin_uri, 0))
+    self.mod_host.add_plugin(plugin_uri, 0)
 
     self.ports = []
 
     plugin = self.plugin_map[plugin_uri]
-    for p in range(plugin.get_num_ports()):
-      port = plugin.get_port(p)
-      port_range = port.get_range()
-      if not (port_range[0] is None or port_range[1] is None):
-        default_val, min_val, max_val = [float(str(v)) for v in port_range]
-        symbol = port.get_symbol()
-        self.ports.append((default_val, min_val, max_val, symbol))
-
-        # val = default_val
-        # resp = self.get_param(0, symbol)
-        # if resp:
-        #   resp_parts = resp.split(' ')
-        #   if len(resp_parts) == 3:
-        #     resp_header, resp_channel, resp_val = resp_parts
-        #     val = float(resp_val[:6])
-        #     self.ports.append((val, min_val, max_val, symbol))
+    for symbol, default_val, min_val, max_val in plugin.symbols:
+      self.ports.append((default_val, min_val, max_val, symbol))
+    self.symbols = SymbolTable(plugin.symbols)
+    self.map_knobs()
+
+      # val = default_val
+      # resp = self.get_param(0, symbol)
+      # if resp:
+      #   resp_parts = resp.split(' ')
+      #   if len(resp_parts) == 3:
+      #     resp_header, resp_channel, resp_val = resp_parts
+      #     val = float(resp_val[:6])
+      #     self.ports.append((val, min_val, max_val, symbol))
+
+
+  def map_knobs(self):
+    if self.symbols is None:
+      return
+    self.cc_mapper.set_slot(
+        0,
+        [
+            CcMapping(
+                channel=None,
+                control=control,
+                symbol=self.symbols.symbols[port],
+                min_val=self.symbols.mins[port],
+                max_val=self.symbols.maxs[port],
+                curve=LINEAR,
+                invert=False,
+                high_res=False,
+                )
+            for control, port in sorted(self.knob_mapping.items())
+            if port < len(self.symbols)
+            ],
+        self.symbols,
+        )
 
 
   def on_midi_event(self, midi_output_name, message):
@@ -150,16 +157,11 @@ class Mod():
       message.note
       message.velocity
     elif message.type == 'control_change':
-      message_channel = message.channel
-      control = message.control
-      effect_number = 0
-      if control in self.knob_mapping:
-        port = self.knob_mapping[control]
-        if port < len(self.ports):
-          val, min_val, max_val, symbol = self.ports[port]
-          val = (max_val - min_val) * (message.value / 127.0) + min_val
-          self.ports[port] = (val, min_val, max_val, symbol)
-          self.set_param(effect_number, symbol, val)
+      # Written through param_writes, only the knobs need updating here.
+      for effect_number, symbol, val in self.cc_mapper.on_message(message):
+        port = self.symbols.get_index(symbol)
+        _, min_val, max_val, _ = self.ports[port]
+        self.ports[port] = (val, min_val, max_val, symbol)
     elif message.type == 'program_change':
       message.channel
       message.program
@@ -202,6 +204,8 @@ class Mod():
             for val, min_val, max_val, symbol in self.ports:
               val = self.get_param(effect_number, symbol)
               print(val, min_val, max_val, symbol)
+          if 8 <= button <= 12:
+            self.map_knobs()
 
 
   def render_menu(self, frame_ui):
@@ -237,47 +241,25 @@ class Mod():
       sleep(delay)
 
 
-  def open_socket(self, host='localhost', port=5555):
-    new_socket = socket.socket()
-    new_socket.connect((host, port))
-    new_socket.settimeout(5)
-    return new_socket
-
-
   def send_command(self, command):
-    self.to_modhost_socket.send(command)
-
-    logger.debug('sent: %s', command)
-
-    resp = None
-
-    try:
-      resp = self.to_modhost_socket.recv(1024)
-      if resp:
-        logger.debug('resp: %s', resp)
-    except Exception:
-      return None
-
-    # try:
-    #   resp = self.from_modhost_socket.recv(1024)
-    #   if resp:
-    #     logging.debug('resp: %s', resp)
-    # except Exception:
-    #   return None
-
-    return resp
+    return self.mod_host.send_command(command)
 
 
   def get_param(self, channel, symbol):
-    return self.send_command('param_get {} {}'.format(channel, symbol))
+    return self.mod_host.get_param(channel, symbol)
 
 
   def set_param(self, channel, symbol, value):
-    return self.send_command('param_set {} {} {}'.format(channel, symbol, value))
+    return self.mod_host.set_param(channel, symbol, value)
+
+
+  def set_params(self, params):
+    # One pipelined batch, see ModHostConnection.send_commands.
+    return self.mod_host.set_params(params)
 
 
   def get_presets(self, URI):
-    return self.send_command('preset_show {}'.format(URI))
+    return self.mod_host.get_presets(URI)
 
 
 ##
@@ -359,39 +341,8 @@ class FrameUI():
 
 
 def connect_audio_midi(jack_client):
-  # Connect A2J Teensy MIDI output to all plugin MIDI inputs
-  teensy_midi_outs = jack_client.get_ports('Teensy', is_midi=True, is_output=True)
-  plugins_midi_ins = jack_client.get_ports('effect_', is_midi=True, is_input=True)
-
-  if len(teensy_midi_outs) == 1 and plugins_midi_ins:
-    for midi_in in plugins_midi_ins:
-      jack_client.connect(teensy_midi_outs[0], midi_in)
-  else:
-    logger.error(
-        'Found wrong amount of MIDI ports: %s outs, %s ins',
-        len(teensy_midi_outs),
-        len(plugins_midi_ins))
-
-  # Connect plugin audio to system audio
-  plugins_audio_outs = jack_client.get_ports(
-      'effect_',
-      is_audio=True,
-      is_output=True,
-      )
-  system_audio_ins = jack_client.get_ports(
-      'system:playback_',
-      is_audio=True,
-      is_input=True,
-      )
-
-  if len(plugins_audio_outs) in [1, 2] and len(system_audio_ins) >= 2:
-    jack_client.connect(plugins_audio_outs[0], system_audio_ins[0])
-    jack_client.connect(plugins_audio_outs[-1], system_audio_ins[1])
-  else:
-    logger.error(
-        'Found wrong amount of audio ports: %s outs, %s ins',
-        len(plugins_audio_outs),
-        len(system_audio_ins))
+  # Teensy MIDI into, and audio out of, the plugin in slot 0.
+  Router(jack_client, midi_out='Teensy').reconcile(['effect_0:'])
 
 
 ##
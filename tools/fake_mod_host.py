@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import logging
+import socket
+import threading
+import time
+
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+
+# mod-host error codes
+ERR_INSTANCE_INVALID = -1
+ERR_INSTANCE_ALREADY_EXISTS = -2
+ERR_INSTANCE_NON_EXISTS = -3
+
+
+class FakeModHost():
+
+  def __init__(self, host='localhost', port=5555, feedback_port=5556, delay=0.0):
+    self.host = host
+    self.port = port
+    self.feedback_port = feedback_port
+    # Seconds to wait before answering each command.
+    self.delay = delay
+
+    # Loaded plugins, {instance_number: (uri, {symbol: value})}.
+    self.lock = threading.Lock()
+    self.instances = {}
+    # MIDI mapped params, {(instance_number, symbol): (channel, cc, min, max)}.
+    self.midi_maps = {}
+    # (instance_number, symbol, min, max) waiting for midi_learn's control.
+    self.learning = None
+    self.feedback_clients = []
+    self.clients = []
+
+    self.servers = []
+    self.running = False
+
+
+  def start(self):
+    self.running = True
+    self.servers = [
+        self.listen(self.port, self.handle_client),
+        self.listen(self.feedback_port, self.handle_feedback_client),
+        ]
+    return self
+
+
+  def stop(self):
+    self.running = False
+    for server in self.servers:
+      # shutdown() also wakes up the thread blocked in accept().
+      try:
+        server.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+      server.close()
+    # Drop connected clients too, like a mod-host that went away.
+    with self.lock:
+      clients = self.clients + self.feedback_clients
+      self.clients, self.feedback_clients = [], []
+    for client in clients:
+      try:
+        client.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+      client.close()
+
+
+  def listen(self, port, handler):
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((self.host, port))
+    server.listen(5)
+
+    def accept():
+      while self.running:
+        try:
+          client, address = server.accept()
+        except socket.error:
+          break
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        thread = threading.Thread(target=handler, args=(client,))
+        thread.daemon = True
+        thread.start()
+
+    thread = threading.Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+  def handle_feedback_client(self, client):
+    with self.lock:
+      self.feedback_clients.append(client)
+
+
+  def send_feedback(self, message):
+    with self.lock:
+      clients = list(self.feedback_clients)
+    for client in clients:
+      try:
+        client.sendall(message.encode('utf-8') + b'\x00')
+      except socket.error:
+        with self.lock:
+          self.feedback_clients.remove(client)
+
+
+  def handle_client(self, client):
+    with self.lock:
+      self.clients.append(client)
+
+    buffered = b''
+    while self.running:
+      try:
+        data = client.recv(4096)
+      except socket.error:
+        break
+      if not data:
+        break
+
+      buffered += data
+      # Commands are NUL-terminated, but like mod-host also accept a lone
+      # unterminated command filling a whole read.
+      if b'\x00' not in buffered:
+        commands, buffered = [buffered], b''
+      else:
+        commands = buffered.split(b'\x00')
+        buffered = commands.pop()
+
+      responses = []
+      for command in commands:
+        if not command:
+          continue
+        if self.delay:
+          time.sleep(self.delay)
+        resp = self.handle_command(command.decode('utf-8'))
+        logger.debug('%s -> %s', command, resp)
+        responses.append(resp.encode('utf-8') + b'\x00')
+
+      try:
+        client.sendall(b''.join(responses))
+      except socket.error:
+        break
+
+    with self.lock:
+      if client in self.clients:
+        self.clients.remove(client)
+    client.close()
+
+
+  def handle_command(self, command):
+    parts = command.split()
+    name, args = parts[0], parts[1:]
+
+    try:
+      with self.lock:
+        if name == 'add':
+          uri, instance_number = args[0], int(args[1])
+          if instance_number in self.instances:
+            return 'resp {}'.format(ERR_INSTANCE_ALREADY_EXISTS)
+          self.instances[instance_number] = (uri, {})
+          return 'resp {}'.format(instance_number)
+
+        elif name == 'remove':
+          instance_number = int(args[0])
+          if instance_number == -1:
+            self.instances.clear()
+          elif self.instances.pop(instance_number, None) is None:
+            return 'resp {}'.format(ERR_INSTANCE_NON_EXISTS)
+          self.forget_midi_maps(instance_number)
+          return 'resp 0'
+
+        elif name == 'param_set':
+          instance_number, symbol, value = int(args[0]), args[1], float(args[2])
+          if instance_number not in self.instances:
+            return 'resp {}'.format(ERR_INSTANCE_NON_EXISTS)
+          self.instances[instance_number][1][symbol] = value
+          return 'resp 0'
+
+        elif name == 'param_get':
+          instance_number, symbol = int(args[0]), args[1]
+          if instance_number not in self.instances:
+            return 'resp {}'.format(ERR_INSTANCE_NON_EXISTS)
+          params = self.instances[instance_number][1]
+          # There's no plugin behind it, so unset params read as 0.
+          return 'resp 0 {}'.format(params.get(symbol, 0.0))
+
+        elif name == 'midi_map':
+          instance_number, symbol = int(args[0]), args[1]
+          channel, cc = int(args[2]), int(args[3])
+          min_val, max_val = float(args[4]), float(args[5])
+          if instance_number not in self.instances:
+            return 'resp {}'.format(ERR_INSTANCE_NON_EXISTS)
+          self.midi_maps[(instance_number, symbol)] = (
+              channel, cc, min_val, max_val)
+          return 'resp 0'
+
+        elif name == 'midi_unmap':
+          instance_number, symbol = int(args[0]), args[1]
+          if instance_number not in self.instances:
+            return 'resp {}'.format(ERR_INSTANCE_NON_EXISTS)
+          self.midi_maps.pop((instance_number, symbol), None)
+          return 'resp 0'
+
+        elif name == 'midi_learn':
+          instance_number, symbol = int(args[0]), args[1]
+          min_val, max_val = float(args[2]), float(args[3])
+          if instance_number not in self.instances:
+            return 'resp {}'.format(ERR_INSTANCE_NON_EXISTS)
+          self.learning = (instance_number, symbol, min_val, max_val)
+          return 'resp 0'
+
+        elif name in ['preset_show', 'output_data_ready']:
+          return 'resp 0'
+
+    except (IndexError, ValueError):
+      pass
+
+    return 'resp {}'.format(ERR_INSTANCE_INVALID)
+
+
+  def forget_midi_maps(self, instance_number):
+    for key in list(self.midi_maps):
+      if instance_number == -1 or key[0] == instance_number:
+        del self.midi_maps[key]
+    if self.learning and instance_number in [-1, self.learning[0]]:
+      self.learning = None
+
+
+  def control_change(self, channel, cc, value):
+    # Like a control change on mod-host's MIDI input: finishes a midi_learn,
+    # moves the mapped params and reports them on the feedback port.
+    feedback = []
+    with self.lock:
+      if self.learning:
+        instance_number, symbol, min_val, max_val = self.learning
+        self.learning = None
+        self.midi_maps[(instance_number, symbol)] = (
+            channel, cc, min_val, max_val)
+        param_value = min_val + (max_val - min_val) * value / 127.0
+        self.instances[instance_number][1][symbol] = param_value
+        feedback.append('midi_mapped {} {} {} {} {} {} {}'.format(
+            instance_number, symbol, channel, cc, param_value, min_val, max_val))
+      else:
+        for (instance_number, symbol), mapping in sorted(self.midi_maps.items()):
+          map_channel, map_cc, min_val, max_val = mapping
+          if (map_channel, map_cc) != (channel, cc):
+            continue
+          param_value = min_val + (max_val - min_val) * value / 127.0
+          self.instances[instance_number][1][symbol] = param_value
+          feedback.append('param_set {} {} {}'.format(
+              instance_number, symbol, param_value))
+    for message in feedback:
+      self.send_feedback(message)
+
+
+  def get_midi_maps(self):
+    with self.lock:
+      return dict(self.midi_maps)
+
+
+  def get_instances(self):
+    with self.lock:
+      return dict((i, uri) for i, (uri, params) in self.instances.items())
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Stand-in for mod-host')
+  parser.add_argument('-p', '--port', default=5555, type=int)
+  parser.add_argument('-f', '--feedback_port', default=5556, type=int)
+  parser.add_argument('-d', '--delay', default=0.0, type=float,
+                      help='seconds to wait before each response')
+  parser.add_argument('--debug', action='store_true')
+  args = parser.parse_args()
+
+  if args.debug:
+    logger.setLevel(logging.DEBUG)
+
+  fake_mod_host = FakeModHost(
+      port=args.port,
+      feedback_port=args.feedback_port,
+      delay=args.delay,
+      ).start()
+
+  print('Listening on ports {} and {}'.format(args.port, args.feedback_port))
+
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    fake_mod_host.stop()
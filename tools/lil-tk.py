@@ -4,18 +4,18 @@
 from __future__ import print_function
 
 import argparse
+import collections
 import logging
 
 from Tkinter import *
 
+from midi_dispatch import MidiDispatcher
 from model import Model
-from util import ModHostConnection
+from plugin_search import IncrementalSearch
+from plugin_search import LetterPicker
+from scenes import DEFAULT_SCENES_PATH
+from scenes import SceneStore
 from util import add_midi_event_listener
-from util import get_plugins
-from util import get_jack_client
-from util import get_ports
-from util import get_symbols
-from util import connect_effect
 
 
 LOG_FILE_PATH = '/home/pi/lil-tk.log'
@@ -34,8 +34,18 @@ SYSEX_FOUR = 11
 SYSEX_FIVE = 12
 SYSEX_SIX = 13
 
+# Learn a control for the first to fourth param shown.
+LEARN_KEYS = 'qwer'
+
 MANUFACTURER_ID = 0x7D
 
+# What the rack is saved as, boot_rack.py --scene loads it again.
+DEFAULT_SCENE_NAME = 'lil-tk'
+
+# How often queued MIDI messages and param changes are handled on Tk's
+# thread.
+EVENTS_POLL_MS = 5
+
 
 logging.basicConfig(
     filename=LOG_FILE_PATH,
@@ -124,12 +134,63 @@ class LoadModulesFrame(Frame):
     Frame.__init__(self, parent)
 
     self.controller = controller
+    self.model = model
+
+    # Type (or pick with the first encoder) to narrow the list down.
+    self.search = IncrementalSearch(model.plugin_search, limit=16)
+    self.letter_picker = LetterPicker()
+    self.query_var = StringVar()
+    Label(self, textvariable=self.query_var, anchor=W).pack(fill=X)
+    self.show_query()
 
-    self.listbox = add_listbox(self, model.get_plugin_urls())
+    self.plugin_urls = model.get_plugin_urls()
+    self.listbox = add_listbox(self, self.plugin_urls)
     self.listbox.selection_set(0)
 
     self.instance_number = instance_number
 
+    self.refresh()
+
+
+  def refresh(self):
+    # Pick up plugins discovered since the last look, until discovery is
+    # done. Views are sorted, so new ones can land anywhere in the list.
+    plugin_urls = self.model.get_plugin_urls()
+    if plugin_urls is not self.plugin_urls:
+      self.plugin_urls = plugin_urls
+      self.show_urls(self.get_visible_urls())
+    if not self.model.plugins_ready.is_set():
+      self.after(250, self.refresh)
+
+
+  def get_visible_urls(self):
+    if not self.search.query:
+      return self.plugin_urls
+    return self.search.get_results()
+
+
+  def show_urls(self, urls):
+    selection = (self.listbox.curselection() or [0])[0]
+    selected = self.listbox.get(selection) if self.listbox.size() else None
+    self.listbox.delete(0, END)
+    for url in urls:
+      self.listbox.insert(END, url)
+    if selected in urls:
+      self.listbox.selection_set(urls.index(selected))
+    else:
+      self.listbox.selection_set(0)
+
+
+  def update_search(self, query):
+    results = self.search.set_query(query)
+    self.show_query()
+    self.show_urls(results if query else self.plugin_urls)
+
+
+  def show_query(self):
+    self.query_var.set('/{}[{}]'.format(
+        self.search.query, self.letter_picker.get_letter()))
+
 
   def on_key(self, event):
     if event.keycode in [36, 114]: # Return, Right
@@ -138,6 +199,10 @@ class LoadModulesFrame(Frame):
       self.handle_event('UP')
     elif event.keycode == 116: # Down
       self.handle_event('DOWN')
+    elif event.keycode == 22: # BackSpace
+      self.update_search(self.search.query[:-1])
+    elif event.char and (event.char.isalnum() or event.char == ' '):
+      self.update_search(self.search.query + event.char)
     else:
       print('{} ({})'.format(event.keysym, event.keycode))
 
@@ -153,6 +218,13 @@ class LoadModulesFrame(Frame):
             self.handle_event('DOWN')
           elif button == SYSEX_RIGHT:
             self.handle_event('SELECT')
+          elif button == SYSEX_FIVE:
+            self.handle_event('TYPE')
+          elif button == SYSEX_SIX:
+            self.handle_event('BACKSPACE')
+    elif message.type == 'control_change' and message.control == 16:
+      self.letter_picker.pick(message.value / 127.0)
+      self.handle_event('PICK')
 
 
   def handle_event(self, event):
@@ -166,6 +238,12 @@ class LoadModulesFrame(Frame):
           self.listbox.get(selection),
           self.instance_number,
           )
+    elif event == 'TYPE':
+      self.update_search(self.search.query + self.letter_picker.get_letter())
+    elif event == 'BACKSPACE':
+      self.update_search(self.search.query[:-1])
+    elif event == 'PICK':
+      self.show_query()
 
 #
 class ControlsFrame(Frame):
@@ -174,13 +252,15 @@ class ControlsFrame(Frame):
     value_var = DoubleVar()
     value_var.set(val)
     label_var = StringVar()
-    label_var.set(key)
+    label_var.set(self.port_names.get(key, key))
     knob = Label(self, text='x', justify=CENTER, wraplength=40, bg=bg)
     knob.grid(row=0, column=column)
+    self.knobs.append((knob, key))
     value = Label(self, textvariable=value_var, justify=CENTER, wraplength=40)
     value.grid(row=1, column=column)
     label = Label(self, textvariable=label_var, justify=CENTER, wraplength=40)
     label.grid(row=2, column=column)
+    self.value_vars[key] = value_var
     return value_var, label_var
 
 
@@ -195,7 +275,18 @@ class ControlsFrame(Frame):
 
     self.offset = 0
 
+    self.value_vars = {}
+    # (symbol, value) pushed from the mod-host feedback thread, Tk isn't
+    # thread safe so drain() sets them on Tk's.
+    self.param_changes = collections.deque()
+    # (knob label, symbol) per column, for learning.
+    self.knobs = []
+    self.learn_column = -1
+    self.model.add_param_listener(self.on_param_changed)
+
     symbols = self.model.get_symbols(self.url)
+    self.symbols = symbols
+    self.port_names = self.model.get_port_names(self.url)
 
     if len(symbols) < 1:
       return
@@ -222,30 +313,68 @@ class ControlsFrame(Frame):
         symbols[3 + self.offset][0], symbols[3 + self.offset][1], 3, 'light blue')
 
 
-  def on_key(self, event):
-    print(event)
+  def destroy(self):
+    self.model.remove_param_listener(self.on_param_changed)
+    self.cancel_learn()
+    Frame.destroy(self)
 
 
-  def on_event(self, message):
-    if message.type == 'control_change':
-      symbols = self.controller.get_symbols(self.url)
+  def on_param_changed(self, channel, symbol, value):
+    if channel == self.instance_number and symbol in self.value_vars:
+      self.param_changes.append((symbol, value))
+
+
+  def drain(self):
+    while self.param_changes:
+      symbol, value = self.param_changes.popleft()
+      self.value_vars[symbol].set(value)
 
-      symbol_index = message.control - 16 + self.offset
 
-      symbol, default_val, min_val, max_val = symbols[symbol_index]
+  def on_key(self, event):
+    if event.char and event.char in LEARN_KEYS:
+      self.learn(LEARN_KEYS.index(event.char))
+    elif event.keycode == 9: # Escape
+      self.cancel_learn()
+    else:
+      print(event)
+
+
+  def learn(self, column):
+    # The next control change moved gets mapped onto the column's param.
+    if column >= len(self.knobs):
+      return
+    self.learn_column = column
+    knob, symbol = self.knobs[column]
+    for other, _ in self.knobs:
+      other.config(text='x')
+    knob.config(text='?')
+    self.model.learn_control(self.instance_number, symbol)
+
 
-      value = (max_val - min_val) * (message.value / 127.0) + min_val
+  def cancel_learn(self):
+    if self.learn_column < 0:
+      return
+    self.knobs[self.learn_column][0].config(text='x')
+    self.learn_column = -1
+    self.model.cancel_learn_control(self.instance_number)
 
-      self.controller.set_param(self.instance_number, symbol, value)
 
-      if message.control == 16:
-        self.value_var1.set(value)
-      elif message.control == 17:
-        self.value_var2.set(value)
-      elif message.control == 18:
-        self.value_var3.set(value)
-      elif message.control == 19:
-        self.value_var4.set(value)
+  def on_event(self, message):
+    if message.type == 'sysex':
+      if len(message.data) == 3:
+        manufacturer_id, button, onoff = message.data
+        if manufacturer_id == MANUFACTURER_ID:
+          if button == SYSEX_FIVE and self.knobs:
+            self.learn((self.learn_column + 1) % len(self.knobs))
+    elif message.type == 'control_change':
+      if self.learn_column >= 0:
+        self.knobs[self.learn_column][0].config(text='x')
+        self.learn_column = -1
+      # A table lookup and a coalesced write per mapped param.
+      for channel, symbol, value in self.model.on_midi_event(
+          message, self.instance_number):
+        if symbol in self.value_vars:
+          self.value_vars[symbol].set(value)
 
 
 #
@@ -258,19 +387,37 @@ class PortsFrame(Frame):
     self.model = model
 
     self.listbox = None
+    # Registry changes last listed, redrawn from drain() as ports come and
+    # go. Its listeners run on JACK's thread, which Tk doesn't take.
+    self.changes = None
     self.list_ports()
 
     self.selected = None
 
 
+  def drain(self):
+    registry = self.model.port_registry
+    if registry and registry.changes != self.changes:
+      self.list_ports()
+
+
   def list_ports(self, effect=''):
-    if self.listbox:
-      self.listbox.destroy()
     # effect = 'effect_{}:'.format(instance_number)
-    ports = [p.name for p in self.model.jack_client.get_ports(effect)]
-    # ports = [p.name for p in self.model.jack_client.get_ports()]
-    self.listbox = add_listbox(self, ports)
-    self.listbox.selection_set(0)
+    # No registry until JACK is up, drain() lists the ports once there is.
+    registry = self.model.port_registry
+    self.changes = registry.changes if registry else None
+    ports = [p.name for p in registry.get_ports(effect)] if registry else []
+    if self.listbox is None:
+      self.listbox = add_listbox(self, ports)
+      self.listbox.selection_set(0)
+      return
+    if list(self.listbox.get(0, END)) == ports:
+      return
+    selection = (self.listbox.curselection() or [0])[0]
+    self.listbox.delete(0, END)
+    for port in ports:
+      self.listbox.insert(END, port)
+    self.listbox.selection_set(min(selection, len(ports) - 1))
 
 
   def on_key(self, event):
@@ -289,7 +436,7 @@ class PortsFrame(Frame):
           elif button == SYSEX_RIGHT:
             selection = (self.listbox.curselection() or [0])[0]
             if self.selected:
-              self.model.jack_client.connect(
+              self.model.port_registry.connect(
                   self.selected,
                   self.listbox.get(selection),
                   )
@@ -303,13 +450,25 @@ class PortsFrame(Frame):
 #
 class LilTKApp:
 
-  def __init__(self, root, width=WIDTH, height=HEIGHT, scale=1):
+  def __init__(
+      self,
+      root,
+      width=WIDTH,
+      height=HEIGHT,
+      scale=1,
+      native_cc=False,
+      scene_name=DEFAULT_SCENE_NAME,
+      scenes_path=DEFAULT_SCENES_PATH,
+      ):
     self.root = root
+    self.scenes = SceneStore(scenes_path)
+    self.scene_name = scene_name
 
     #
-    self.model = Model()
+    # Start-up carries on in the background, frames fill in as it's ready.
+    self.model = Model(background=True, native_cc=native_cc)
 
-    self.model.clear_modules()
+    self.model.when_ready(self.model.mod_host_ready, self.model.clear_modules)
 
     #
     self.root.title('lil-tk')
@@ -333,7 +492,22 @@ class LilTKApp:
     self.root.bind("<Key>", self.on_key)
 
     #
-    add_midi_event_listener(self.on_midi_event)
+    # Handlers touch Tk widgets, so run them on Tk's thread.
+    self.midi_dispatcher = MidiDispatcher(self.on_midi_event, worker=False)
+    add_midi_event_listener(self.midi_dispatcher.put)
+    self.drain_events()
+
+
+  def drain_events(self):
+    # Everything from other threads is handled here, on Tk's.
+    try:
+      self.midi_dispatcher.drain()
+      drain = getattr(self.active_frame, 'drain', None)
+      if drain:
+        drain()
+    finally:
+      # One failing handler mustn't stop the rest for good.
+      self.root.after(EVENTS_POLL_MS, self.drain_events)
 
 
   def set_instance_number(self, instance_number):
@@ -341,7 +515,7 @@ class LilTKApp:
 
 
   def set_param(self, instance_number, symbol, value):
-    self.model.set_param(instance_number, symbol, value)
+    self.model.queue_param(instance_number, symbol, value)
 
 
   def get_symbols(self, url):
@@ -413,6 +587,8 @@ class LilTKApp:
       self.show_controls_frame(instance)
     elif event.char == '4':
       self.show_ports_frame(self.instance_number)
+    elif event.char == '5':
+      self.save_scene()
     else:
       self.active_frame.on_key(event)
 
@@ -441,6 +617,15 @@ class LilTKApp:
       self.active_frame.on_event(message)
 
 
+  def save_scene(self):
+    try:
+      self.scenes.save(self.scene_name, self.model.capture_scene())
+    except (IOError, OSError) as e:
+      logger.error('Couldn\'t save scene %s: %s', self.scene_name, e)
+      return
+    logger.info('Saved scene %s', self.scene_name)
+
+
   def load_into_instance(self, url, instance_number):
     self.model.add_module(url, instance_number)
     self.show_modules_frame()
@@ -457,10 +642,16 @@ class LilTKApp:
 
 
 #
-def main():
+def main(native_cc=False, scene_name=DEFAULT_SCENE_NAME,
+         scenes_path=DEFAULT_SCENES_PATH):
   root = Tk()
 
-  app = LilTKApp(root)
+  app = LilTKApp(
+      root,
+      native_cc=native_cc,
+      scene_name=scene_name,
+      scenes_path=scenes_path,
+      )
 
   root.mainloop()
 
@@ -469,6 +660,11 @@ def main():
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument('--debug', action='store_true')
+  parser.add_argument('--native_cc', action='store_true',
+                      help='let mod-host map knobs onto params itself')
+  parser.add_argument('-s', '--scene', default=DEFAULT_SCENE_NAME,
+                      help='name key 5 saves the rack as')
+  parser.add_argument('--scenes_path', default=DEFAULT_SCENES_PATH)
   args = parser.parse_args()
 
   debug = args.debug
@@ -476,4 +672,4 @@ if __name__ == '__main__':
   if debug:
     logger.setLevel(logging.DEBUG)
 
-  main()
+  main(args.native_cc, args.scene, args.scenes_path)
@@ -6,9 +6,8 @@ import socket
 
 from Tkinter import *
 
-from lilv import World
-from lilv import Plugin
-from lilv import Instance
+from plugin_cache import load_plugin_details
+from plugin_cache import load_plugins
 
 
 class LilUIApp:
@@ -22,11 +21,11 @@ class LilUIApp:
     self.to_modhost_socket = self.open_socket(port=5555)
     self.from_modhost_socket = self.open_socket(port=5556)
 
-    world = World()
-    world.load_all()
-    self.plugins = world.get_all_plugins()
+    self.plugins, self.plugin_map = load_plugins()
+    # {port name: symbol} of the plugin shown, scales are labelled by name.
+    self.port_symbols = {}
 
-    self.list = self.add_listbox(self.frame, [p.get_uri() for p in self.plugins])
+    self.list = self.add_listbox(self.frame, [p.uri for p in self.plugins])
     self.list.bind('<<ListboxSelect>>', self.onselect)
 
 
@@ -43,29 +42,22 @@ class LilUIApp:
       # self.get_presets(value)
 
       for plugin in self.plugins:
-        name = unicode(plugin.get_name()).encode('utf-8')
-        uri = plugin.get_uri()
-        num_ports = plugin.get_num_ports()
-        if uri == value:
-          for p in range(num_ports):
-            port = plugin.get_port(p)
-            index = port.get_index()
-            name = unicode(port.get_name()).encode('utf-8')
-            port_range = port.get_range()
-            scale_points = port.get_scale_points()
-            symbol = port.get_symbol()
-
-            default_val, min_val, max_val = port_range
-            if not default_val is None:
-              scale = self.add_scale(
-                  self.frame,
-                  from_val=min_val,
-                  to_val=max_val,
-                  default=default_val,
-                  label=name,
-                  )
-              scale.bind("<B1-Motion>", self.on_scale_change)
-              self.controls.append(scale)
+        if plugin.uri == value:
+          # The cache only has symbols, names come from the plugin's bundle.
+          names = dict(
+              (p.symbol, p.name) for p in load_plugin_details(plugin))
+          for symbol, default_val, min_val, max_val in plugin.symbols:
+            name = names.get(symbol, symbol)
+            self.port_symbols[name] = symbol
+            scale = self.add_scale(
+                self.frame,
+                from_val=min_val,
+                to_val=max_val,
+                default=default_val,
+                label=name,
+                )
+            scale.bind("<B1-Motion>", self.on_scale_change)
+            self.controls.append(scale)
 
 
   def on_scale_change(self, event):
@@ -75,13 +67,9 @@ class LilUIApp:
     label = widget.cget('label')
 
     for i, plugin in enumerate(self.plugins):
-      if plugin.get_uri() == selection:
-        for p in range(plugin.get_num_ports()):
-          port = plugin.get_port(p)
-          symbol = port.get_symbol()
-          name = unicode(port.get_name()).encode('utf-8')
-          if name == label:
-            self.send_command('param_set {} {} {}'.format(i, symbol, value))
+      if plugin.uri == selection:
+        symbol = self.port_symbols.get(label, label)
+        self.send_command('param_set {} {} {}'.format(i, symbol, value))
 
 
   def add_listbox(self, master, options):
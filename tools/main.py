@@ -9,10 +9,12 @@ import logging
 import pygame
 
 from fb import FramebufferUI
+from midi_dispatch import MidiDispatcher
 from model import Model
+from plugin_search import IncrementalSearch
+from plugin_search import LetterPicker
 import util
 from util import add_midi_event_listener
-from util import connect_effect
 from tape import Tape
 import tapy
 
@@ -33,10 +35,6 @@ SYSEX_SIX = 13
 MANUFACTURER_ID = 0x7D
 
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    filemode='w',
-    )
 logger = logging.getLogger(__name__)
 
 
@@ -99,7 +97,6 @@ class Master:
     self.model.add_module(
         self.active_plugin_url,
         self.active_channel)
-    connect_effect(self.model.jack_client, 'effect_0:')
 
 
 class TapyTapes:
@@ -203,17 +200,45 @@ class Plugins:
 
     self.plugin_urls = model.get_instrument_plugin_urls()
 
+    # Type (or pick with the encoder) to narrow the list down.
+    self.search = IncrementalSearch(model.plugin_search, limit=16)
+    self.letter_picker = LetterPicker()
+    self.results = None
+
 
   def on_draw(self):
     self.screen.fill((0, 0, 0))
 
-    visible_range = range(
-        max(0, self.selected-3),
-        min(self.selected+4, len(self.plugin_urls)))[:4]
+    # Cached in the model's plugin index, only rebuilt after discovery adds
+    # more plugins.
+    plugin_urls = self.model.get_instrument_plugin_urls()
+    if plugin_urls is not self.plugin_urls:
+      self.plugin_urls, self.results = plugin_urls, None
+
+    if not self.plugin_urls and not self.model.plugins_ready.is_set():
+      text_surface = self.font.render(
+          'Loading plugins...', False, (255, 255, 255))
+      self.screen.blit(text_surface, (10, 0))
+      return
 
     y = 0
+    plugin_urls = self.get_visible_urls()
+    rows = 4
+    if self.search.query:
+      text_surface = self.font.render(
+          '/{}[{}]'.format(self.search.query, self.letter_picker.get_letter()),
+          False,
+          (255, 255, 0))
+      self.screen.blit(text_surface, (10, y))
+      y += 25
+      rows = 3
+
+    visible_range = range(
+        max(0, self.selected-rows+1),
+        min(self.selected+rows, len(plugin_urls)))[:rows]
+
     for i in visible_range:
-      plugin_url = self.plugin_urls[i]
+      plugin_url = plugin_urls[i]
       label = str(plugin_url)
       label = label.replace('http://', '')
       label = label if len(label) < 26 else label[:12] + '...' + label[-12:]
@@ -225,19 +250,70 @@ class Plugins:
       y += 25
 
 
+  def get_visible_urls(self):
+    if not self.search.query:
+      return self.plugin_urls
+    if self.results is None:
+      # Discovery may have moved on since, redo the search.
+      self.results = self.search.get_results(within=self.plugin_urls)
+    return self.results
+
+
+  def update_search(self, query):
+    self.results = self.search.set_query(query, within=self.plugin_urls)
+    self.selected = 0
+    self.preload_neighbours()
+
+
+  def preload_neighbours(self):
+    # With standby slots, the entries either side of the selection are
+    # already loaded by the time they're picked.
+    plugin_urls = self.get_visible_urls()
+    self.model.preload_modules([
+        plugin_urls[i]
+        for i in [self.selected + 1, self.selected - 1]
+        if 0 <= i < len(plugin_urls)
+        ])
+
+
   def on_pygame_event(self, event):
     if event.type == pygame.KEYDOWN:
       if event.key == 273: # up
         self.selected = max(0, self.selected-1)
+        self.preload_neighbours()
       elif event.key == 274: # down
-        self.selected = min(self.selected+1, len(self.plugin_urls))
+        self.selected = min(self.selected+1, len(self.get_visible_urls())-1)
+        self.preload_neighbours()
       elif event.key == 13: # enter
-        plugin_url = str(self.plugin_urls[self.selected])
-        self.master.set_active_plugin_url(plugin_url)
+        plugin_urls = self.get_visible_urls()
+        if plugin_urls:
+          plugin_url = str(plugin_urls[self.selected])
+          self.master.set_active_plugin_url(plugin_url)
+      elif event.key == 8: # backspace
+        self.update_search(self.search.query[:-1])
+      elif event.key == 276: # left
+        self.letter_picker.step(-1)
+      elif event.key == 275: # right
+        self.letter_picker.step(+1)
+      elif event.key == 9: # tab
+        self.update_search(self.search.query + self.letter_picker.get_letter())
+      elif event.unicode and event.unicode.isalnum():
+        self.update_search(self.search.query + event.unicode)
+      elif event.key == 32 and self.search.query: # space
+        self.update_search(self.search.query + ' ')
 
 
   def on_midi_event(self, midi_input_name, message):
-    return
+    if message.type == 'control_change' and message.control == 16:
+      # First encoder picks the letter.
+      self.letter_picker.pick(message.value / 127.0)
+    elif message.type == 'sysex' and len(message.data) == 3:
+      manufacturer_id, button, onoff = message.data
+      if manufacturer_id == MANUFACTURER_ID and onoff:
+        if button == SYSEX_FIVE:
+          self.update_search(self.search.query + self.letter_picker.get_letter())
+        elif button == SYSEX_SIX:
+          self.update_search(self.search.query[:-1])
 
 
 class Controls:
@@ -264,7 +340,7 @@ class Controls:
       symbol, min_val, default_val, max_val = self.symbols[symbol_no]
       param_val = self.model.get_param(self.active_channel, symbol)
       text_surface = self.font.render(
-          '{}: {}'.format(symbol, param_val),
+          '{}: {}'.format(symbol, '...' if param_val is None else param_val),
           False,
           (255, 255, 255))
       text_surface = pygame.transform.rotate(text_surface, -90)
@@ -307,20 +383,36 @@ class Controls:
   def adjust(self, channel, symbol_no, adjustment):
     symbol, min_val, default_val, max_val = self.symbols[symbol_no]
     param_val = self.model.get_param(channel, symbol)
+    if param_val is None:
+      # Still being asked of mod-host.
+      return
     self.model.set_param(channel, symbol, param_val + adjustment)
 
 
 #
-def main():
-  model = Model()
-  model.clear_modules()
+def main(async_mod_host=False, low_memory=False, standby_slots=0):
+  mod_host = None
+  if async_mod_host:
+    from async_mod_host import ThreadedModHostConnection
+    mod_host = ThreadedModHostConnection()
+
+  # Start-up carries on in the background, screens fill in as it's ready.
+  model = Model(
+      mod_host=mod_host,
+      background=True,
+      low_memory=low_memory,
+      standby_slots=standby_slots,
+      )
+  model.when_ready(model.mod_host_ready, model.clear_modules)
 
   fbui = FramebufferUI()
   fbui.clear((0, 0, 0))
 
   master = Master(model, fbui.screen)
 
-  add_midi_event_listener(master.on_midi_event)
+  # Handlers talk to mod-host, keep them off the MIDI input threads.
+  midi_dispatcher = MidiDispatcher(master.on_midi_event)
+  add_midi_event_listener(midi_dispatcher.put)
   fbui.run_loop(
       master.on_pygame_event,
       master.on_draw,
@@ -330,16 +422,30 @@ def main():
 
 #
 if __name__ == '__main__':
+  # Only here, plugin scan workers import this module again and would
+  # truncate the log.
+  logging.basicConfig(
+      filename=LOG_FILE_PATH,
+      filemode='w',
+      )
+
   parser = argparse.ArgumentParser()
 
   parser.add_argument('--debug', action='store_true')
+  parser.add_argument('--async_mod_host', action='store_true')
+  parser.add_argument('--low_memory', action='store_true')
+  parser.add_argument('--standby_slots', default=0, type=int,
+                      help='plugins to keep preloaded for instant switching')
 
   args = parser.parse_args()
 
   debug = args.debug
+  async_mod_host = args.async_mod_host
+  low_memory = args.low_memory
+  standby_slots = args.standby_slots
 
   if debug:
     logger.setLevel(logging.DEBUG)
     util.logger.setLevel(logging.DEBUG)
 
-  main()
+  main(async_mod_host, low_memory, standby_slots)
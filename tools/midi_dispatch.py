@@ -0,0 +1,212 @@
+#
+
+import collections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_BATCH_SIZE = 32
+# Arrival to handler delays kept for get_stats().
+DELAY_SAMPLES = 1024
+
+# What happens to a message of a type while it waits in the queue:
+# MERGE: a newer one for the same input, channel and controller replaces it
+#        in place, handlers only see the latest value.
+# DROP:  thrown away first when the queue is full.
+# KEEP:  never thrown away once queued. When the queue is full of them the
+#        oldest note on makes room, or else the new message is dropped.
+MERGE = 'merge'
+DROP = 'drop'
+KEEP = 'keep'
+
+DEFAULT_POLICIES = {
+    'control_change': MERGE,
+    'pitchwheel': MERGE,
+    'aftertouch': MERGE,
+    'polytouch': MERGE,
+    'clock': DROP,
+    'active_sensing': DROP,
+    }
+
+
+def get_merge_key(input_name, message):
+  # Messages with the same key only differ in value.
+  return (
+      input_name,
+      message.type,
+      getattr(message, 'channel', None),
+      getattr(message, 'control', None),
+      getattr(message, 'note', None),
+      )
+
+
+class MidiDispatcher():
+  # Takes MIDI messages off mido's input threads as quickly as possible:
+  # put() only timestamps and queues them. Handlers run either on a worker
+  # thread, or on the UI's own thread through drain().
+
+  def __init__(
+      self,
+      handler,
+      max_size=DEFAULT_QUEUE_SIZE,
+      batch_size=DEFAULT_BATCH_SIZE,
+      policies=None,
+      worker=True,
+      ):
+    # handler(input_name, message), like add_midi_event_listener's.
+    self.handler = handler
+    self.max_size = max_size
+    self.batch_size = batch_size
+    self.policies = DEFAULT_POLICIES if policies is None else policies
+
+    self.lock = threading.Condition()
+    # [arrival_time, input_name, message] entries, oldest first.
+    self.queue = collections.deque()
+    # {merge key: entry} for MERGE messages still in the queue.
+    self.merging = {}
+
+    self.received = 0
+    self.dispatched = 0
+    self.merged = 0
+    self.dropped = 0
+    self.max_depth = 0
+    self.delays = collections.deque(maxlen=DELAY_SAMPLES)
+
+    self.running = True
+    self.thread = None
+    if worker:
+      self.thread = threading.Thread(target=self.run)
+      self.thread.daemon = True
+      self.thread.start()
+
+
+  def put(self, input_name, message):
+    # Called on mido's input threads, must never block for long.
+    now = time.time()
+    policy = self.policies.get(message.type, KEEP)
+
+    with self.lock:
+      self.received += 1
+
+      if policy == MERGE:
+        key = get_merge_key(input_name, message)
+        entry = self.merging.get(key)
+        if entry is not None:
+          # Keeps its place and arrival time, so delays aren't understated.
+          entry[2] = message
+          self.merged += 1
+          return
+
+      if len(self.queue) >= self.max_size and not self.make_room(policy):
+        self.dropped += 1
+        return
+
+      entry = [now, input_name, message]
+      self.queue.append(entry)
+      if policy == MERGE:
+        self.merging[key] = entry
+      self.max_depth = max(self.max_depth, len(self.queue))
+      self.lock.notify()
+
+
+  def make_room(self, policy):
+    # Drops the oldest DROP message, then the oldest MERGE one. KEEP
+    # messages may also push out the oldest queued note on, which at worst
+    # leaves its note off with nothing to stop; a note off or a button
+    # press is never dropped once queued, that would leave notes stuck.
+    # Returns False if the new message is the one to go.
+    if policy == DROP:
+      return False
+    for victim_policy in [DROP, MERGE]:
+      for entry in self.queue:
+        if self.policies.get(entry[2].type, KEEP) == victim_policy:
+          self.remove(entry)
+          return True
+    if policy == KEEP:
+      for entry in self.queue:
+        if entry[2].type == 'note_on' and getattr(entry[2], 'velocity', 0):
+          self.remove(entry)
+          return True
+    return False
+
+
+  def remove(self, entry):
+    self.queue.remove(entry)
+    self.forget(entry)
+    self.dropped += 1
+
+
+  def forget(self, entry):
+    key = get_merge_key(entry[1], entry[2])
+    if self.merging.get(key) is entry:
+      del self.merging[key]
+
+
+  def take(self, count):
+    with self.lock:
+      batch = []
+      while self.queue and len(batch) < count:
+        entry = self.queue.popleft()
+        self.forget(entry)
+        batch.append(entry)
+      return batch
+
+
+  def dispatch(self, batch):
+    for arrival_time, input_name, message in batch:
+      # get_stats() reads them on another thread.
+      with self.lock:
+        self.delays.append(time.time() - arrival_time)
+      try:
+        self.handler(input_name, message)
+      except Exception as e:
+        logger.error('MIDI handler failed on %s: %s', message, e)
+    with self.lock:
+      self.dispatched += len(batch)
+
+
+  def drain(self, max_count=None):
+    # For UIs that want handlers on their own thread, e.g. from Tk's after().
+    # Returns the number of messages handled.
+    batch = self.take(max_count or self.batch_size)
+    self.dispatch(batch)
+    return len(batch)
+
+
+  def run(self):
+    while self.running:
+      with self.lock:
+        while self.running and not self.queue:
+          self.lock.wait()
+      batch = self.take(self.batch_size)
+      self.dispatch(batch)
+
+
+  def stop(self):
+    with self.lock:
+      self.running = False
+      self.lock.notify_all()
+
+
+  def get_stats(self):
+    with self.lock:
+      stats = {
+          'depth': len(self.queue),
+          'max_depth': self.max_depth,
+          'received': self.received,
+          'dispatched': self.dispatched,
+          'merged': self.merged,
+          'dropped': self.dropped,
+          }
+      delays = sorted(self.delays)
+    if delays:
+      stats['delay_p50_ms'] = 1000 * delays[len(delays) // 2]
+      stats['delay_p99_ms'] = 1000 * delays[
+          min(len(delays) - 1, len(delays) * 99 // 100)]
+      stats['delay_max_ms'] = 1000 * delays[-1]
+    return stats
@@ -3,11 +3,19 @@
 from __future__ import print_function
 
 import argparse
+import itertools
+import threading
 from time import sleep
 
 import mido
 
 
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+# Notes the stress mode cycles through, from the given note up.
+STRESS_NOTES = 12
+
+
 def print_diagnostics():
   input_names = mido.get_input_names()
   ioport_names = mido.get_ioport_names()
@@ -46,6 +54,170 @@ def send_keys(note=60, velocity=100, bpm=60, output_index=0):
     output.send(mido.Message('note_off', note=note))
 
 
+def get_pattern_events(note=60, velocity=100, bpm=60):
+  # (seconds from start, MIDI bytes), the same toggling as send_keys(). Times
+  # are computed, not summed, so nothing drifts however long it plays.
+  half_beat = 60.0 / bpm / 2.0
+  for n in itertools.count():
+    yield (2 * n * half_beat, bytes(bytearray([NOTE_ON, note, velocity])))
+    yield ((2 * n + 1) * half_beat, bytes(bytearray([NOTE_OFF, note, 0])))
+
+
+def get_stress_events(rate, note=60, velocity=100):
+  # rate events a second, alternating note on and off over a few notes.
+  period = 1.0 / rate
+  for n in itertools.count():
+    event_note = note + (n // 2) % STRESS_NOTES
+    if n % 2 == 0:
+      data = bytes(bytearray([NOTE_ON, event_note, velocity]))
+    else:
+      data = bytes(bytearray([NOTE_OFF, event_note, 0]))
+    yield (n * period, data)
+
+
+def get_smf_events(path, loop=False):
+  # Channel messages of a Standard MIDI File, all tracks merged.
+  midi_file = mido.MidiFile(path)
+  events = []
+  time = 0.0
+  for message in midi_file:
+    time += message.time
+    if not message.is_meta and message.type != 'sysex':
+      events.append((time, bytes(bytearray(message.bytes()))))
+  length = midi_file.length
+  # Looping nothing, or a file with no length, would never get anywhere.
+  if not loop or not events or length <= 0:
+    return iter(events)
+  # Each pass starts where the file ends, rests at the end included.
+  return (
+      (n * length + time, data)
+      for n in itertools.count() for time, data in events)
+
+
+class JackMidiPlayer():
+  # Plays events from a JACK MIDI output port, written into the port buffer
+  # at their exact frame offset inside the process callback, so timing is
+  # as good as JACK's clock. Events due in a cycle that's already gone (e.g.
+  # after an xrun) go out at the start of the next one and count as late.
+
+  def __init__(self, events, client_name='midi_out', connect=''):
+    import jack
+
+    # events: iterator of (seconds from start, MIDI bytes), in order.
+    self.events = iter(events)
+    self.next_event = next(self.events, None)
+
+    self.client = jack.Client(client_name, no_start_server=True)
+    self.port = self.client.midi_outports.register('out')
+    self.client.set_process_callback(self.process)
+    self.samplerate = self.client.samplerate
+    self.connect_pattern = connect
+
+    # Frame time of the first cycle, set in process().
+    self.start_frame = None
+    self.sounding = set()
+    self.stopping = False
+    self.stopped = threading.Event()
+    self.finished = threading.Event()
+
+    self.sent = 0
+    self.late = 0
+    self.dropped = 0
+    self.max_per_cycle = 0
+
+
+  def start(self):
+    self.client.activate()
+    if self.connect_pattern:
+      for port in self.client.get_ports(
+          self.connect_pattern, is_midi=True, is_input=True):
+        self.client.connect(self.port, port)
+    return self
+
+
+  def process(self, frames):
+    self.port.clear_buffer()
+    cycle_start = self.client.last_frame_time
+    if self.start_frame is None:
+      self.start_frame = cycle_start
+
+    if self.stopping:
+      # Don't leave anything hanging.
+      for channel, note in self.sounding:
+        self.port.write_midi_event(0, (NOTE_OFF | channel, note, 0))
+      self.sounding.clear()
+      self.stopped.set()
+      return
+
+    cycle_end = cycle_start + frames
+    count = 0
+    while self.next_event is not None:
+      time, data = self.next_event
+      frame = self.start_frame + int(round(time * self.samplerate))
+      if frame >= cycle_end:
+        break
+      offset = frame - cycle_start
+      if offset < 0:
+        offset = 0
+        self.late += 1
+      try:
+        self.port.write_midi_event(offset, data)
+        self.sent += 1
+        count += 1
+        self.track(data)
+      except Exception:
+        # The port buffer is full, the stress mode can get there.
+        self.dropped += 1
+      self.next_event = next(self.events, None)
+
+    self.max_per_cycle = max(self.max_per_cycle, count)
+    if self.next_event is None:
+      self.finished.set()
+
+
+  def track(self, data):
+    status = data[0] if isinstance(data[0], int) else ord(data[0])
+    if status & 0xF0 == NOTE_ON and data[2]:
+      self.sounding.add((status & 0x0F, data[1]))
+    elif status & 0xF0 in [NOTE_ON, NOTE_OFF]:
+      self.sounding.discard((status & 0x0F, data[1]))
+
+
+  def stop(self, timeout=1.0):
+    self.stopping = True
+    self.stopped.wait(timeout)
+    self.client.deactivate()
+    self.client.close()
+
+
+  def get_stats(self):
+    return {
+        'samplerate': self.samplerate,
+        'blocksize': self.client.blocksize,
+        'sent': self.sent,
+        'late': self.late,
+        'dropped': self.dropped,
+        'max_per_cycle': self.max_per_cycle,
+        }
+
+
+def play_jack(events, connect='', duration=0):
+  player = JackMidiPlayer(events, connect=connect).start()
+  print('Playing from {} at {} Hz'.format(
+      player.port.name, player.samplerate))
+  try:
+    # Ends early when a (non-looping) file runs out.
+    player.finished.wait(duration or None)
+    if player.finished.is_set():
+      # Let the last notes off out.
+      sleep(2.0 * player.client.blocksize / player.samplerate)
+  except KeyboardInterrupt:
+    pass
+  player.stop()
+  stats = player.get_stats()
+  print(' '.join('{}={}'.format(key, stats[key]) for key in sorted(stats)))
+
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='')
   parser.add_argument('-d', '--diagnostics', action='store_true', help='')
@@ -53,6 +225,18 @@ if __name__ == '__main__':
   parser.add_argument('-n', '--note', default=60, type=int, nargs='?', help='')
   parser.add_argument('-v', '--velocity', default=60, type=int, nargs='?', help='')
   parser.add_argument('-b', '--bpm', default=60, type=int, nargs='?', help='')
+  parser.add_argument('-j', '--jack', action='store_true',
+                      help='play from a JACK MIDI port, sample accurate')
+  parser.add_argument('-c', '--connect', default='',
+                      help='JACK MIDI inputs to connect to, e.g. effect_')
+  parser.add_argument('-f', '--file',
+                      help='Standard MIDI File to play (with --jack)')
+  parser.add_argument('-l', '--loop', action='store_true',
+                      help='play the file over and over')
+  parser.add_argument('-s', '--stress', default=0, type=float,
+                      help='events a second to flood with (with --jack)')
+  parser.add_argument('-t', '--duration', default=0, type=float,
+                      help='seconds to play for (with --jack), 0 for ever')
   args = parser.parse_args()
 
   diagnostics = args.diagnostics
@@ -64,4 +248,13 @@ if __name__ == '__main__':
   if diagnostics:
     print_diagnostics()
 
-  send_keys(note, velocity, bpm, output_index)
+  if args.jack:
+    if args.file:
+      events = get_smf_events(args.file, args.loop)
+    elif args.stress:
+      events = get_stress_events(args.stress, note, velocity)
+    else:
+      events = get_pattern_events(note, velocity, bpm)
+    play_jack(events, args.connect, args.duration)
+  else:
+    send_keys(note, velocity, bpm, output_index)
@@ -1,51 +1,343 @@
 #
 
+import logging
+import socket
+import threading
+import time
+
+from cc_mapping import CcMapper
+from cc_mapping import CcMappingStore
+from cc_mapping import CcMapping
+from cc_mapping import LINEAR
+from cc_mapping import can_map_natively
+from cc_mapping import format_midi_learn
+from cc_mapping import format_midi_map
+from cc_mapping import format_midi_unmap
+from cc_mapping import get_default_mappings
+from cc_mapping import replace_mapping
 from util import ModHostConnection
-from util import get_plugins
 from util import get_jack_client
 # from util import get_ports
-from util import get_symbols
-from util import connect_effect
+from plugin_cache import load_plugin_details
+from plugin_cache import load_plugins
+from plugin_index import LV2_INSTRUMENT_CLASS
+from plugin_index import PluginIndex
+from plugin_search import PluginSearch
+from port_registry import PortRegistry
+from routing import MOD_HOST_MIDI_IN
+from routing import Router
+from scenes import from_slot_port
+from scenes import get_port_slot
+from scenes import to_slot_port
+from standby import STANDBY_INSTANCE_BASE
+from standby import StandbyPool
+from symbol_table import SymbolTable
+from param_coalescer import DEFAULT_CONTROL_RATE_HZ
+from param_coalescer import ParamCoalescer
+from supervisor import MAX_BACKOFF_SECONDS
+from supervisor import MIN_BACKOFF_SECONDS
+from supervisor import ModHostSupervisor
+
+
+logger = logging.getLogger(__name__)
+
+
+def when_done(resp, callback):
+  # Calls callback(response) now, or once the future the threaded asyncio
+  # client hands back is done, without waiting for it. The response is None
+  # for a command that timed out or failed.
+  if not hasattr(resp, 'add_done_callback'):
+    callback(resp)
+    return
+
+  def done(future):
+    try:
+      result = future.result()
+    except Exception as e:
+      logger.warning('mod-host command failed: %s', e)
+      result = None
+    callback(result)
+  resp.add_done_callback(done)
 
 
 class Model:
 
-  def __init__(self):
+  def __init__(
+      self,
+      mod_host=None,
+      plugins=None,
+      use_jack=True,
+      control_rate=DEFAULT_CONTROL_RATE_HZ,
+      supervise=True,
+      background=False,
+      low_memory=False,
+      standby_slots=0,
+      midi_out='',
+      native_cc=False,
+      ):
     self.plugins_slots = {}
+    # {slot: mod-host instance number}, slots not in here use their own
+    # number. They only differ after switching to a preloaded standby.
+    self.slot_instances = {}
+    # Also the StandbyPool's lock, so it never hands out an instance number
+    # that's on its way into or out of a slot.
+    self.instances_lock = threading.RLock()
+    # Scan changed bundles in a throwaway process even on one core, so no
+    # lilv World ever lives in this one.
+    self.low_memory = low_memory
+
+    # Authoritative parameter values, {(channel, symbol): value}. Seeded from
+    # the LV2 defaults and updated on every write, mod-host is only asked
+    # again on an explicit resync_params().
+    self.param_values = {}
+    # Also written from the mod-host feedback thread.
+    self.params_lock = threading.RLock()
+    # Keys asked of mod-host and not answered yet, see query_param().
+    self.params_pending = set()
+    # Keys mod-host failed to answer for, not asked again. A value written
+    # or pushed for the key takes over, forget_params() clears them.
+    self.params_failed = set()
+    # Callbacks called with (channel, symbol, value) on pushed param changes.
+    self.param_listeners = []
+
+    # Filled in by discover_plugins(). Views handed out to screens are
+    # immutable, ask again for newly discovered plugins.
+    self.plugin_index = PluginIndex()
+    self.plugin_search = PluginSearch()
+    # {url: SymbolTable}, built once per plugin and shared by all screens.
+    self.symbol_tables = {}
+    # {url: {symbol: port name}}, read from the bundle on first use.
+    self.port_names = {}
+
+    self.mod_host = None
+    self.jack_client = None
+    # Name pattern of the MIDI sources routed into the plugins.
+    self.midi_out = midi_out
+    # Connections on top of the default routing, from the last recalled
+    # scene. (source, destination), see scenes.py for the port names.
+    self.extra_connections = []
+    # In-memory JACK graph, kept current by JACK callbacks.
+    self.port_registry = None
+    self.router = None
+
+    # Knob movements go through here so only the newest value per param is
+    # sent, at most control_rate times a second.
+    self.param_writes = ParamCoalescer(self.set_params, control_rate)
+    # Control changes to params through per-plugin lookup tables, see
+    # on_midi_event() and learn_control().
+    self.cc_mappings = CcMappingStore()
+    self.cc_mapper = CcMapper(self.queue_param)
+    # Leave the mappings mod-host can do itself (midi_map) to mod-host, fed
+    # straight from the MIDI sources over JACK, so knobs move params inside
+    # the audio engine. Values are only mirrored here from the feedback.
+    self.native_cc = native_cc
+    # {slot: [CcMapping]} registered with mod-host.
+    self.native_mappings = {}
+    # (slot, symbol) while mod-host is learning a control for it.
+    self.native_learning = None
+
+    self.supervisor = None
+
+    # Spare mod-host instances for preload_modules(), off unless asked for.
+    self.standby = StandbyPool(self, standby_slots) if standby_slots else None
+
+    # Set once each part of start-up is done, failed parts set them too and
+    # leave mod_host or jack_client as None.
+    self.plugins_ready = threading.Event()
+    self.mod_host_ready = threading.Event()
+    self.jack_ready = threading.Event()
+
+    startup = [
+        (self.plugins_ready, lambda: self.discover_plugins(plugins)),
+        (self.mod_host_ready,
+         lambda: self.connect_mod_host(mod_host, supervise, retry=background)),
+        (self.jack_ready, lambda: self.connect_jack(use_jack)),
+        ]
+
+    if not background:
+      for ready, task in startup:
+        task()
+        ready.set()
+      return
+
+    # Let the UI draw its first frame while the plugin scan, the mod-host
+    # connection and the JACK activation happen side by side.
+    for ready, task in startup:
+      thread = threading.Thread(target=self.run_startup_task, args=(task, ready))
+      thread.daemon = True
+      thread.start()
+
+
+  def run_startup_task(self, task, ready):
+    try:
+      task()
+    except Exception as e:
+      logger.error('Start-up failed: %s', e)
+    finally:
+      ready.set()
+
+
+  def discover_plugins(self, plugins=None):
+    # PluginInfo records from the on-disk cache, lilv only runs for bundles
+    # that changed since the last start.
+    if plugins is not None:
+      self.add_plugins(plugins[0])
+    else:
+      load_plugins(on_plugins=self.add_plugins, isolated=self.low_memory)
+
+
+  def get_plugin_details(self, url):
+    # Port names and classes aren't cached, reload just that plugin's bundle.
+    plugin = self.plugin_index.get(url)
+    if plugin is None:
+      return []
+    return load_plugin_details(plugin)
+
+
+  def get_port_names(self, url):
+    # {symbol: port name}, for labels. Kept, they're small and reloading the
+    # bundle isn't.
+    names = self.port_names.get(url)
+    if names is None:
+      names = dict((p.symbol, p.name) for p in self.get_plugin_details(url))
+      self.port_names[url] = names
+    return names
+
+
+  def add_plugins(self, plugins):
+    self.plugin_index.add_plugins(plugins)
+    self.plugin_search.add_plugins(plugins)
+
+
+  def connect_mod_host(self, mod_host=None, supervise=True, retry=False):
+    # retry: keep knocking until mod-host is up, e.g. when the UI came up
+    # first, with the same backoff as ModHostSupervisor.
+    backoff = MIN_BACKOFF_SECONDS
+    while not mod_host:
+      try:
+        mod_host = ModHostConnection()
+      except socket.error as e:
+        if not retry:
+          raise
+        logger.debug('mod-host not up yet: %s', e)
+        time.sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    # Live values pushed by mod-host, e.g. when a MIDI-mapped knob moves.
+    mod_host.start_feedback_listener().subscribe(self.on_feedback)
+
+    self.mod_host = mod_host
+
+    # Reconnect and restore the rack when mod-host gets restarted.
+    if supervise and hasattr(self.mod_host, 'reconnect'):
+      self.supervisor = ModHostSupervisor(self)
 
-    #
-    self.plugins, self.plugin_map = get_plugins()
-    self.plugin_urls = [p.get_uri() for p in self.plugins]
 
-    self.instrument_plugin_urls = []
-    for plugin in self.plugins:
-      if not str(plugin.get_class()) == 'http://lv2plug.in/ns/lv2core#InstrumentPlugin':
-        continue
-      self.instrument_plugin_urls.append(plugin.get_uri())
+  def connect_jack(self, use_jack=True):
+    # Without JACK (e.g. benchmarking against a fake mod-host) nothing is routed.
+    if use_jack:
+      jack_client = get_jack_client('lilt_jack_client', activate=False)
+      # Callbacks can only be set up before activating.
+      self.port_registry = PortRegistry(jack_client)
+      jack_client.activate()
+      self.port_registry.refresh()
+      self.router = Router(
+          jack_client,
+          self.midi_out,
+          registry=self.port_registry,
+          control_in=MOD_HOST_MIDI_IN if self.native_cc else None,
+          )
+      self.jack_client = jack_client
 
-    #
-    self.mod_host = ModHostConnection()
 
-    #
-    self.jack_client = get_jack_client('lilt_jack_client')
+  def wait_for_mod_host(self):
+    self.mod_host_ready.wait()
+    if not self.mod_host:
+      raise Exception('Not connected to mod-host')
+    return self.mod_host
+
+
+  def wait_for_jack(self):
+    self.jack_ready.wait()
+    return self.jack_client
+
+
+  def when_ready(self, ready, callback):
+    # Runs callback on a helper thread once the given *_ready event is set.
+    def run():
+      ready.wait()
+      callback()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
 
 
   def get_plugin_urls(self):
-    return self.plugin_urls
+    return self.plugin_index.get_view()
 
 
   def get_instrument_plugin_urls(self):
-    return self.instrument_plugin_urls
+    # Includes subclasses of lv2:InstrumentPlugin.
+    return self.plugin_index.get_view(plugin_class=LV2_INSTRUMENT_CLASS)
+
+
+  def get_plugin_view(self, **filters):
+    # See PluginIndex.get_view for the filters.
+    return self.plugin_index.get_view(**filters)
 
 
   def clear_modules(self):
-    for i in range(len(self.plugins_slots)):
-      self.clear_module(i)
+    # Scenes can leave gaps, e.g. slots 0 and 2 only.
+    slots = list(self.plugins_slots)
+    for i in slots:
+      self.param_writes.discard(i)
+    with self.instances_lock:
+      instances = [
+          self.get_instance(i) for i in slots if self.plugins_slots[i]]
+      if self.standby:
+        instances.extend(self.standby.clear())
+      self.slot_instances.clear()
+    self.wait_for_mod_host().remove_plugins(instances)
+    for i in slots:
+      self.plugins_slots[i] = ''
+      self.forget_params(i)
+      self.forget_controls(i)
 
 
   def clear_module(self, i):
-    self.mod_host.remove_plugin(i)
-    self.plugins_slots[i] = ''
+    self.unload_modules([i])
+
+
+  def unload_modules(self, slots):
+    for i in slots:
+      self.param_writes.discard(i)
+    self.wait_for_mod_host().remove_plugins(
+        [self.get_instance(i) for i in slots])
+    # Slots keep their instance number, a standby may hold their own.
+    for i in slots:
+      self.plugins_slots[i] = ''
+      self.forget_params(i)
+      self.forget_extra_connections(i)
+      self.forget_controls(i)
+
+
+  def get_instance(self, slot):
+    return self.slot_instances.get(slot, slot)
+
+
+  def get_slot(self, instance):
+    # The slot a mod-host instance is playing in, None for standbys.
+    for slot, slot_instance in self.slot_instances.items():
+      if slot_instance == instance:
+        return slot
+    if instance in self.slot_instances or instance >= STANDBY_INSTANCE_BASE:
+      return None
+    return instance
+
+
+  def get_effect_name(self, slot):
+    # JACK client name prefix of the slot's plugin.
+    return 'effect_{}:'.format(self.get_instance(slot))
 
 
   # def add_modules(self, plugins):
@@ -62,28 +354,469 @@ class Model:
 
 
   def add_module(self, url, i):
-    self.mod_host.remove_plugin(i)
-    self.mod_host.add_plugin(url, i)
+    self.load_modules({i: url})
+    self.route()
+
 
+  def load_modules(self, slots):
+    # slots: {slot: url}. Preloaded standbys are switched to, the rest are
+    # loaded as one pipelined batch. Doesn't route, see route().
+    commands = []
+    for i, url in sorted(slots.items()):
+      self.param_writes.discard(i)
+      self.forget_extra_connections(i)
+
+      with self.instances_lock:
+        standby = self.standby.take(url) if self.standby else None
+        if standby:
+          instance, params = standby
+          self.switch_module(url, i, instance, params)
+          continue
+
+      commands.extend([
+          'remove {}'.format(self.get_instance(i)),
+          'add {} {}'.format(url, self.get_instance(i)),
+          ])
+      self.plugins_slots[i] = url
+      self.seed_params(i, url)
+      # Went with the removed plugin.
+      self.native_mappings.pop(i, None)
+      commands.extend(self.map_controls(i, url))
+
+    if commands:
+      self.wait_for_mod_host().send_commands(commands)
+
+
+  def switch_module(self, url, i, instance, params):
+    # The plugin is already running in mod-host as instance, only the JACK
+    # routing changes. The plugin switched away from becomes a standby.
+    # Called with instances_lock held, see load_modules().
+    old_url = self.plugins_slots.get(i)
+    old_instance = self.get_instance(i)
+    # Standbys must not follow the knobs.
+    commands = self.stop_learning(i) + [
+        format_midi_unmap(old_instance, m.symbol)
+        for m in self.native_mappings.pop(i, [])]
+    with self.params_lock:
+      old_params = dict(
+          (symbol, value)
+          for (channel, symbol), value in self.param_values.items()
+          if channel == i)
+
+    if instance == i:
+      self.slot_instances.pop(i, None)
+    else:
+      self.slot_instances[i] = instance
     self.plugins_slots[i] = url
+    self.seed_params(i, url, params)
+    commands.extend(self.map_controls(i, url))
+    if commands:
+      self.wait_for_mod_host().send_commands(commands)
+
+    # The next route() makes only the new instance's connections and drops
+    # the old one's, everything else is left as it is.
+    if old_url:
+      evicted = self.standby.put(old_instance, old_url, old_params)
+      self.wait_for_mod_host().remove_plugins(evicted)
+
+
+  def seed_params(self, i, url, params=None):
+    # Defaults from the LV2 metadata, overridden by params, {symbol: value}.
+    self.forget_params(i)
+    with self.params_lock:
+      if self.plugin_index.get(url):
+        for symbol, default_val, min_val, max_val in self.get_symbols(url):
+          self.param_values[(i, symbol)] = default_val
+      for symbol, value in (params or {}).items():
+        self.param_values[(i, symbol)] = value
+
+
+  def map_controls(self, i, url, mappings=None):
+    # Maps controls onto the slot's params: mappings, or the plugin's
+    # learned ones, or knobs 1 to 4 onto its first four params. Returns the
+    # mod-host commands to send for the ones left to mod-host.
+    if not self.plugin_index.get(url):
+      # E.g. booted from a scene without scanning plugins.
+      self.forget_controls(i)
+      return []
+    symbols = self.get_symbols(url)
+    if mappings is None:
+      mappings = self.cc_mappings.load(url)
+    if mappings is None:
+      mappings = get_default_mappings(symbols)
+
+    native = []
+    if self.native_cc:
+      native = [
+          m for m in mappings
+          if can_map_natively(m) and m.symbol in symbols.index]
+      mappings = [m for m in mappings if m not in native]
+    self.cc_mapper.set_slot(i, mappings, symbols)
+
+    # Only what changed, mod-host keeps a mapping per param.
+    instance = self.get_instance(i)
+    old = dict((m.symbol, m) for m in self.native_mappings.get(i, []))
+    new = dict((m.symbol, m) for m in native)
+    self.native_mappings[i] = native
+    return [
+        format_midi_unmap(instance, symbol)
+        for symbol in sorted(old) if symbol not in new
+        ] + [
+        format_midi_map(instance, m)
+        for symbol, m in sorted(new.items()) if old.get(symbol) != m
+        ]
+
+
+  def forget_controls(self, i):
+    # The slot's instance is gone, and any learn in mod-host with it.
+    self.stop_learning(i)
+    self.cc_mapper.clear_slot(i)
+    self.native_mappings.pop(i, None)
 
-    connect_effect(self.jack_client, 'effect_{}'.format(i))
+
+  def get_control_mappings(self, i):
+    return self.cc_mapper.get_mappings(i) + self.native_mappings.get(i, [])
+
+
+  def learn_control(self, i, symbol):
+    # Maps the next control change onto the slot's param, and keeps the
+    # mapping for every slot that plays the same plugin later.
+    url = self.plugins_slots.get(i)
+    if not url:
+      return
+    # One learn at a time.
+    commands = self.stop_learning()
+    if not self.native_cc:
+      self.cc_mapper.learn(
+          i, symbol, lambda slot, mappings: self.cc_mappings.save(url, mappings))
+      return
+
+    # mod-host hears the control itself, and says which in midi_mapped.
+    symbols = self.get_symbols(url)
+    n = symbols.get_index(symbol)
+    self.native_learning = (i, symbol)
+    commands.append(format_midi_learn(
+        self.get_instance(i), symbol, symbols.mins[n], symbols.maxs[n]))
+    self.wait_for_mod_host().send_commands(commands)
+
+
+  def cancel_learn_control(self, i=None):
+    # Stops learning for slot i, or for whichever slot is learning.
+    commands = self.stop_learning(i)
+    if commands:
+      self.wait_for_mod_host().send_commands(commands)
+
+
+  def stop_learning(self, i=None):
+    # Returns the mod-host commands that stop a native learn.
+    learning = self.cc_mapper.learning
+    if learning and i in [None, learning[0]]:
+      self.cc_mapper.cancel_learn()
+
+    if not self.native_learning or i not in [None, self.native_learning[0]]:
+      return []
+    slot, symbol = self.native_learning
+    self.native_learning = None
+    # midi_unmap drops the learn, along with the mapping it replaced, so
+    # that one is made again.
+    instance = self.get_instance(slot)
+    return [format_midi_unmap(instance, symbol)] + [
+        format_midi_map(instance, m)
+        for m in self.native_mappings.get(slot, []) if m.symbol == symbol]
+
+
+  def on_control_learned(self, i, symbol, channel, control, min_val, max_val):
+    # mod-host has mapped it already, only the rest of the slot's mappings
+    # may need updating.
+    self.native_learning = None
+    url = self.plugins_slots.get(i)
+    if not url:
+      return
+    mappings = replace_mapping(
+        self.get_control_mappings(i),
+        CcMapping(
+            channel=channel,
+            control=control,
+            symbol=symbol,
+            min_val=min_val,
+            max_val=max_val,
+            curve=LINEAR,
+            invert=False,
+            high_res=False,
+            ))
+    self.cc_mappings.save(url, mappings)
+    commands = self.map_controls(i, url, mappings)
+    if commands:
+      self.mod_host.send_commands(commands)
+    logger.info('Learned CC %s for %s in slot %s', control, symbol, i)
+
+
+  def on_midi_event(self, message, slot=None):
+    # Returns the (slot, symbol, value) params the message changed, the
+    # writes themselves are coalesced. See CcMapper.on_message().
+    return self.cc_mapper.on_message(message, slot)
+
+
+  def preload_modules(self, urls):
+    # Load these into standby instances in the background, so a following
+    # add_module() of any of them is a quick reroute. No-op unless Model
+    # was created with standby_slots.
+    if self.standby:
+      self.standby.preload(urls)
+
+
+  def replay_rack(self):
+    # Reload every slot, its known param values and control mappings into a
+    # fresh mod-host as one pipelined burst, then route the new plugin ports
+    # again.
+    slots = sorted((i, url) for i, url in self.plugins_slots.items() if url)
+    with self.params_lock:
+      params = sorted(self.param_values.items())
+    if self.standby:
+      # Went down with the old mod-host.
+      self.standby.clear()
+
+    commands = []
+    for i, url in slots:
+      instance = self.get_instance(i)
+      commands.append('add {} {}'.format(url, instance))
+      commands.extend(
+          'param_set {} {} {}'.format(instance, symbol, value)
+          for (channel, symbol), value in params if channel == i)
+      commands.extend(
+          format_midi_map(instance, m)
+          for m in self.native_mappings.get(i, []))
+    self.mod_host.send_commands(commands)
+
+    self.route()
+
+
+  def route(self):
+    # Brings the JACK graph in line with the rack, see routing.Router.
+    self.wait_for_jack()
+    if self.router:
+      self.router.reconcile(
+          self.get_effect_names(),
+          [(from_slot_port(source, self.get_effect_name),
+            from_slot_port(destination, self.get_effect_name))
+           for source, destination in self.extra_connections])
+
+
+  def get_effect_names(self):
+    return [
+        self.get_effect_name(i)
+        for i, url in sorted(self.plugins_slots.items()) if url]
+
+
+  def forget_extra_connections(self, slot):
+    # They were made for the plugin that's being replaced.
+    self.extra_connections = [
+        c for c in self.extra_connections
+        if slot not in [get_port_slot(c[0]), get_port_slot(c[1])]]
+
+
+  def capture_scene(self):
+    # The rack, its param values and any connections beyond the default
+    # routing, see scenes.py.
+    slots = dict((i, url) for i, url in self.plugins_slots.items() if url)
+    with self.params_lock:
+      params = sorted(self.param_values.items())
+
+    connections = []
+    self.wait_for_jack()
+    if self.router:
+      instance_slots = dict((self.get_instance(i), i) for i in slots)
+      for source, destination in self.router.get_extra_connections(
+          self.get_effect_names()):
+        connection = (
+            to_slot_port(source, instance_slots),
+            to_slot_port(destination, instance_slots))
+        if None not in connection:
+          connections.append(connection)
+
+    return {
+        'slots': dict(
+            (i, {
+                'url': url,
+                'params': dict(
+                    (symbol, value)
+                    for (channel, symbol), value in params if channel == i),
+                })
+            for i, url in slots.items()),
+        'connections': connections,
+        }
+
+
+  def recall_scene(self, scene):
+    # Only changes what differs from the live rack: slots already playing
+    # the right plugin stay loaded, the rest are unloaded or (pipelined)
+    # loaded, changed params go out as one batch and JACK is reconciled
+    # once. Returns (unloaded, loaded, params sent).
+    start = time.time()
+    wanted = dict((i, slot['url']) for i, slot in scene['slots'].items())
+
+    unload = sorted(
+        i for i, url in self.plugins_slots.items() if url and i not in wanted)
+    if unload:
+      self.unload_modules(unload)
+
+    load = dict(
+        (i, url) for i, url in wanted.items() if self.plugins_slots.get(i) != url)
+    self.load_modules(load)
+
+    params = []
+    with self.params_lock:
+      for i, slot in sorted(scene['slots'].items()):
+        for symbol, value in sorted(slot['params'].items()):
+          if self.param_values.get((i, symbol)) != value:
+            params.append((i, symbol, value))
+    if params:
+      self.set_params(params)
+
+    self.extra_connections = list(scene.get('connections', []))
+    self.route()
+
+    logger.info(
+        'Scene recalled in %.0f ms: %s unloaded, %s loaded, %s params',
+        1000 * (time.time() - start), len(unload), len(load), len(params))
+    return (len(unload), len(load), len(params))
 
 
   def get_param(self, channel, symbol):
-    status, val = self.mod_host.get_param(channel, symbol)
-    if status == 0:
-      return val
-    raise Exception('Got status {}'.format(status))
+    # None while the value isn't known yet, see query_param().
+    key = (channel, symbol)
+    with self.params_lock:
+      if key in self.param_values:
+        return self.param_values[key]
+    return self.query_param(channel, symbol)
+
+
+  def query_param(self, channel, symbol):
+    # Asks mod-host. The blocking client's answer is returned, the threaded
+    # asyncio client's arrives later through the param listeners and None
+    # is returned, so the UI never waits on mod-host.
+    key = (channel, symbol)
+    with self.params_lock:
+      if key in self.params_pending or key in self.params_failed:
+        # E.g. asked again by the next frame drawn.
+        return None
+      self.params_pending.add(key)
+    values = []
+
+    def on_response(resp):
+      failed = not resp or resp[0] != 0
+      with self.params_lock:
+        self.params_pending.discard(key)
+        if failed:
+          self.params_failed.add(key)
+      if failed:
+        logger.warning('Failed to get %s %s: %s', channel, symbol, resp)
+        return
+      self.update_param(channel, symbol, resp[1])
+      values.append(resp[1])
+
+    when_done(
+        self.wait_for_mod_host().get_param(self.get_instance(channel), symbol),
+        on_response)
+    return values[0] if values else None
+
+
+  def resync_params(self, channel=None):
+    # Re-read every known param (of one channel, or all) in a single batch.
+    # Doesn't wait for the threaded asyncio client, new values go to the
+    # param listeners.
+    with self.params_lock:
+      keys = [k for k in self.param_values if channel is None or k[0] == channel]
+
+    def on_responses(responses):
+      for key, resp in zip(keys, responses or [None] * len(keys)):
+        if resp and resp[0] == 0:
+          self.update_param(key[0], key[1], resp[1])
+        else:
+          logger.warning('Failed to resync %s: %s', key, resp)
+
+    when_done(
+        self.wait_for_mod_host().get_params(
+            [(self.get_instance(c), symbol) for c, symbol in keys]),
+        on_responses)
+
+
+  def forget_params(self, channel):
+    with self.params_lock:
+      for key in [k for k in self.param_values if k[0] == channel]:
+        del self.param_values[key]
+      self.params_failed = set(
+          k for k in self.params_failed if k[0] != channel)
+
+
+  def on_feedback(self, name, args):
+    if name == 'param_set':
+      channel, symbol, value = args
+    elif name == 'midi_mapped':
+      channel, symbol, value = args[0], args[1], args[4]
+    elif name == 'data_finish':
+      # mod-host holds further feedback until we've taken this batch.
+      self.mod_host.send_command('output_data_ready')
+      return
+    else:
+      return
+
+    channel = self.get_slot(channel)
+    if channel is None:
+      return
+
+    if name == 'midi_mapped' and self.native_learning == (channel, symbol):
+      self.on_control_learned(channel, symbol, args[2], args[3], args[5], args[6])
+
+    self.update_param(channel, symbol, value)
+
+
+  def update_param(self, channel, symbol, value):
+    # A value that changed in mod-host rather than through us.
+    with self.params_lock:
+      self.param_values[(channel, symbol)] = value
+    for listener in list(self.param_listeners):
+      listener(channel, symbol, value)
+
+
+  def add_param_listener(self, listener):
+    self.param_listeners.append(listener)
+
+
+  def remove_param_listener(self, listener):
+    if listener in self.param_listeners:
+      self.param_listeners.remove(listener)
 
 
   def set_param(self, channel, symbol, value):
-    self.mod_host.set_param(channel, symbol, value)
+    with self.params_lock:
+      self.param_values[(channel, symbol)] = value
+    self.wait_for_mod_host().set_param(self.get_instance(channel), symbol, value)
+
+
+  def queue_param(self, channel, symbol, value):
+    with self.params_lock:
+      self.param_values[(channel, symbol)] = value
+    self.param_writes.set_param(channel, symbol, value)
+
+
+  def set_params(self, params):
+    # params: iterable of (channel, symbol, value), sent as one pipelined batch.
+    params = list(params)
+    with self.params_lock:
+      for channel, symbol, value in params:
+        self.param_values[(channel, symbol)] = value
+    self.wait_for_mod_host().set_params(
+        (self.get_instance(channel), symbol, value)
+        for channel, symbol, value in params)
 
 
   def get_symbols(self, url):
-    plugin = self.plugin_map[url]
-    return get_symbols(plugin)
+    table = self.symbol_tables.get(url)
+    if table is None:
+      table = SymbolTable(self.plugin_index.get(url).symbols)
+      self.symbol_tables[url] = table
+    return table
 
 
   def get_instances(self):
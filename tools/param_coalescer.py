@@ -0,0 +1,69 @@
+#
+
+import collections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_CONTROL_RATE_HZ = 30
+
+
+class ParamCoalescer():
+
+  def __init__(self, write_params, rate_hz=DEFAULT_CONTROL_RATE_HZ):
+    # write_params is called with a list of (instance_number, symbol, value).
+    self.write_params = write_params
+    self.interval = 1.0 / rate_hz
+
+    self.lock = threading.Lock()
+    self.pending = collections.OrderedDict()
+    self.wakeup = threading.Event()
+    self.running = True
+
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def set_param(self, instance_number, symbol, value):
+    # Latest value wins, older unsent values for the same param are dropped.
+    with self.lock:
+      self.pending[(instance_number, symbol)] = value
+    self.wakeup.set()
+
+
+  def discard(self, instance_number):
+    with self.lock:
+      for key in [k for k in self.pending if k[0] == instance_number]:
+        del self.pending[key]
+
+
+  def flush(self):
+    with self.lock:
+      pending, self.pending = self.pending, collections.OrderedDict()
+    if pending:
+      self.write_params(
+          [(i, symbol, value) for (i, symbol), value in pending.items()])
+
+
+  def run(self):
+    while self.running:
+      self.wakeup.wait()
+      self.wakeup.clear()
+      try:
+        self.flush()
+      except Exception as e:
+        logger.error('Failed to write params: %s', e)
+      # Values arriving meanwhile pile up and go out together next round.
+      time.sleep(self.interval)
+
+
+  def stop(self):
+    self.running = False
+    self.wakeup.set()
+    self.thread.join()
+    self.flush()
@@ -0,0 +1,299 @@
+#
+
+import collections
+import json
+import logging
+import multiprocessing
+import os
+
+try:
+  from sys import intern
+except ImportError:
+  # A builtin on Python 2.
+  pass
+
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_VERSION = 3
+
+DEFAULT_LV2_PATH = ['~/.lv2', '/usr/local/lib/lv2', '/usr/lib/lv2']
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.getenv('XDG_CACHE_HOME', '~/.cache'), 'lil-t', 'lv2_plugins.json')
+
+
+# What Model needs to know about a plugin, without keeping lilv around.
+# symbols: [(symbol, default_val, min_val, max_val), ...] like util.get_symbols
+# classes: plugin_class and all its superclasses, see util.get_class_ancestry
+PluginInfo = collections.namedtuple(
+    'PluginInfo',
+    [
+        'uri',
+        'name',
+        'plugin_class',
+        'bundle',
+        'is_midi',
+        'symbols',
+        'classes',
+        'audio_inputs',
+        'audio_outputs',
+        'required_features',
+        'author',
+        ],
+    )
+
+
+# Port details the cache leaves out, see load_plugin_details().
+PortInfo = collections.namedtuple(
+    'PortInfo',
+    ['index', 'symbol', 'name', 'classes'],
+    )
+
+
+def get_lv2_path():
+  lv2_path = os.getenv('LV2_PATH')
+  paths = lv2_path.split(os.pathsep) if lv2_path else DEFAULT_LV2_PATH
+  return [os.path.expanduser(p) for p in paths]
+
+
+def get_bundle_dirs(lv2_path=None):
+  bundle_dirs = []
+  for path in lv2_path or get_lv2_path():
+    if not os.path.isdir(path):
+      continue
+    for name in sorted(os.listdir(path)):
+      bundle_dir = os.path.join(path, name)
+      if name.endswith('.lv2') and os.path.isdir(bundle_dir):
+        bundle_dirs.append(bundle_dir)
+  return bundle_dirs
+
+
+def get_bundle_stamp(bundle_dir):
+  # Newest mtime and total size of the bundle's files, any edit, added or
+  # removed .ttl or rebuilt .so changes it.
+  mtime = os.stat(bundle_dir).st_mtime
+  size = 0
+  for name in os.listdir(bundle_dir):
+    st = os.stat(os.path.join(bundle_dir, name))
+    mtime = max(mtime, st.st_mtime)
+    size += st.st_size
+  return [mtime, size]
+
+
+def read_cache(cache_path):
+  try:
+    with open(cache_path) as f:
+      cache = json.load(f)
+  except (IOError, OSError, ValueError):
+    return {}
+  if cache.get('version') != CACHE_VERSION:
+    return {}
+  return cache.get('bundles', {})
+
+
+def write_cache(cache_path, bundles):
+  cache_dir = os.path.dirname(cache_path)
+  if not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  # Write aside and rename, a half-written cache must never be read back.
+  tmp_path = cache_path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(
+        {'version': CACHE_VERSION, 'bundles': bundles},
+        f,
+        separators=(',', ':'),
+        )
+  os.rename(tmp_path, cache_path)
+
+
+def extract_plugin_info(plugin, bundle_dir, class_parents):
+  # Only needed when a bundle actually gets scanned.
+  from util import get_class_ancestry
+  from util import get_port_classes
+  from util import get_symbols
+  from util import is_audio_input
+  from util import is_audio_output
+  from util import is_midi_input
+
+  is_midi = False
+  audio_inputs = audio_outputs = 0
+  for p in range(plugin.get_num_ports()):
+    port_classes = get_port_classes(plugin.get_port(p))
+    is_midi = is_midi or is_midi_input(port_classes)
+    audio_inputs += is_audio_input(port_classes)
+    audio_outputs += is_audio_output(port_classes)
+
+  plugin_class = str(plugin.get_class())
+  author = plugin.get_author_name()
+
+  return PluginInfo(
+      uri=str(plugin.get_uri()),
+      name=str(plugin.get_name()),
+      plugin_class=plugin_class,
+      bundle=bundle_dir,
+      is_midi=is_midi,
+      symbols=[
+          (str(symbol), default_val, min_val, max_val)
+          for symbol, default_val, min_val, max_val in get_symbols(plugin)
+          ],
+      classes=get_class_ancestry(plugin_class, class_parents),
+      audio_inputs=audio_inputs,
+      audio_outputs=audio_outputs,
+      required_features=sorted(
+          str(feature) for feature in plugin.get_required_features()),
+      author=str(author) if author else '',
+      )
+
+
+def scan_bundles(bundle_dirs):
+  # Returns {bundle_dir: [PluginInfo, ...]} for the given bundles only.
+  from lilv import World
+  from util import get_class_parents
+
+  world = World()
+  world.load_specifications()
+  world.load_plugin_classes()
+  class_parents = get_class_parents(world)
+
+  bundle_uris = {}
+  for bundle_dir in bundle_dirs:
+    bundle_uri = 'file://' + os.path.abspath(bundle_dir) + '/'
+    bundle_uris[bundle_uri] = bundle_dir
+    world.load_bundle(world.new_uri(bundle_uri))
+
+  scanned = dict((bundle_dir, []) for bundle_dir in bundle_dirs)
+  for plugin in world.get_all_plugins():
+    bundle_dir = bundle_uris.get(str(plugin.get_bundle_uri()))
+    if bundle_dir is None:
+      continue
+    try:
+      scanned[bundle_dir].append(extract_plugin_info(plugin, bundle_dir, class_parents))
+    except Exception as e:
+      logger.warning('Skipping plugin %s: %s', plugin.get_uri(), e)
+  return scanned
+
+
+def scan_bundles_parallel(bundle_dirs, processes=None, isolated=False):
+  # Every worker process gets its own lilv World and a share of the bundles,
+  # the results are merged back into one {bundle_dir: [PluginInfo, ...]}.
+  # isolated scans in a worker even on one core, so the RDF data never
+  # lands in (and fragments) the heap of the calling process.
+  processes = min(processes or multiprocessing.cpu_count(), len(bundle_dirs))
+  if processes < 2 and not isolated:
+    return scan_bundles(bundle_dirs)
+  processes = max(processes, 1)
+
+  chunks = [bundle_dirs[i::processes] for i in range(processes)]
+  # Scans run from a background thread while JACK and socket threads are
+  # busy, and a forked child can inherit a lock one of them held and hang.
+  # Workers are spawned as fresh interpreters instead, where Python has
+  # get_context (3.4 and up).
+  get_context = getattr(multiprocessing, 'get_context', None)
+  context = get_context('spawn') if get_context else multiprocessing
+  pool = context.Pool(processes)
+  try:
+    results = pool.map(scan_bundles, chunks)
+  finally:
+    pool.close()
+    pool.join()
+
+  scanned = {}
+  for result in results:
+    scanned.update(result)
+  return scanned
+
+
+def load_plugins(
+    lv2_path=None,
+    cache_path=DEFAULT_CACHE_PATH,
+    processes=None,
+    on_plugins=None,
+    isolated=False,
+    ):
+  # Same (plugins, plugin_map) shape as util.get_plugins, built from the
+  # on-disk cache. Only bundles whose stamp changed are scanned with lilv.
+  # on_plugins, if given, is called with each batch of PluginInfo as it
+  # becomes available: first the cached ones, then the rescanned ones.
+  cache_path = os.path.expanduser(cache_path)
+  cached = read_cache(cache_path)
+
+  bundles = {}
+  stale = []
+  for bundle_dir in get_bundle_dirs(lv2_path):
+    stamp = get_bundle_stamp(bundle_dir)
+    entry = cached.get(bundle_dir)
+    if entry and entry['stamp'] == stamp:
+      bundles[bundle_dir] = entry
+    else:
+      bundles[bundle_dir] = {'stamp': stamp, 'plugins': []}
+      stale.append(bundle_dir)
+
+  if on_plugins:
+    # Hand out what's cached straight away, before any lilv scanning.
+    on_plugins(get_plugin_infos(bundles))
+
+  if stale:
+    logger.info('Scanning %s changed LV2 bundles', len(stale))
+    scanned = scan_bundles_parallel(stale, processes, isolated)
+    for bundle_dir, infos in scanned.items():
+      bundles[bundle_dir]['plugins'] = [list(info) for info in infos]
+    if on_plugins:
+      on_plugins(get_plugin_infos(dict((b, bundles[b]) for b in scanned)))
+
+  if stale or len(bundles) != len(cached):
+    try:
+      write_cache(cache_path, bundles)
+    except (IOError, OSError) as e:
+      logger.warning('Couldn\'t write plugin cache: %s', e)
+
+  plugins = get_plugin_infos(bundles)
+  plugin_map = dict((p.uri, p) for p in plugins if p.is_midi)
+
+  return (plugins, plugin_map)
+
+
+def get_plugin_infos(bundles):
+  plugins = []
+  for bundle_dir in sorted(bundles):
+    bundle_dir = intern(str(bundle_dir))
+    for fields in bundles[bundle_dir]['plugins']:
+      info = PluginInfo(*fields)
+      # Class URIs and bundles repeat across plugins, share one copy each.
+      plugins.append(info._replace(
+          plugin_class=intern(str(info.plugin_class)),
+          bundle=bundle_dir,
+          symbols=tuple(
+              (intern(str(s[0])), s[1], s[2], s[3]) for s in info.symbols),
+          classes=tuple(intern(str(c)) for c in info.classes),
+          required_features=tuple(
+              intern(str(f)) for f in info.required_features),
+          ))
+  return plugins
+
+
+def load_plugin_details(info):
+  # Loads just the plugin's own bundle into a throwaway World for what the
+  # cache leaves out, the World is released again before returning.
+  from lilv import World
+
+  world = World()
+  world.load_specifications()
+  world.load_bundle(world.new_uri('file://' + os.path.abspath(info.bundle) + '/'))
+
+  ports = []
+  for plugin in world.get_all_plugins():
+    if str(plugin.get_uri()) != info.uri:
+      continue
+    for p in range(plugin.get_num_ports()):
+      port = plugin.get_port(p)
+      ports.append(PortInfo(
+          index=p,
+          symbol=str(port.get_symbol()),
+          name=str(port.get_name()),
+          classes=[str(c) for c in port.get_classes()],
+          ))
+
+  del world
+  return ports
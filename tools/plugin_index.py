@@ -0,0 +1,107 @@
+#
+
+import collections
+import threading
+
+
+LV2_INSTRUMENT_CLASS = 'http://lv2plug.in/ns/lv2core#InstrumentPlugin'
+
+
+class PluginIndex():
+  # PluginInfo records bucketed by class (including superclasses), MIDI
+  # input, audio port counts and required features. Filtered, sorted views
+  # are built on first request and then kept until more plugins arrive.
+
+  def __init__(self, plugins=()):
+    self.lock = threading.Lock()
+
+    # {uri: PluginInfo}
+    self.plugins = {}
+    # {class_uri: set(uri)}, a plugin is listed under all its superclasses.
+    self.by_class = collections.defaultdict(set)
+    self.midi = set()
+    # {(audio_inputs, audio_outputs): set(uri)}
+    self.by_audio = collections.defaultdict(set)
+    # {feature_uri: set(uri)}
+    self.by_feature = collections.defaultdict(set)
+
+    # {filter key: (uri, ...)}
+    self.views = {}
+
+    self.add_plugins(plugins)
+
+
+  def __len__(self):
+    return len(self.plugins)
+
+
+  def add_plugins(self, plugins):
+    with self.lock:
+      for plugin in plugins:
+        self.plugins[plugin.uri] = plugin
+        for plugin_class in plugin.classes or [plugin.plugin_class]:
+          self.by_class[plugin_class].add(plugin.uri)
+        if plugin.is_midi:
+          self.midi.add(plugin.uri)
+        self.by_audio[(plugin.audio_inputs, plugin.audio_outputs)].add(
+            plugin.uri)
+        for feature in plugin.required_features:
+          self.by_feature[feature].add(plugin.uri)
+      self.views = {}
+
+
+  def get(self, uri):
+    return self.plugins.get(uri)
+
+
+  def get_view(
+      self,
+      plugin_class=None,
+      midi=None,
+      audio_inputs=None,
+      audio_outputs=None,
+      supported_features=None,
+      ):
+    # Sorted by name, then uri. None means don't filter on that property.
+    # supported_features leaves out plugins requiring any feature not in it.
+    if supported_features is not None:
+      supported_features = frozenset(supported_features)
+    key = (plugin_class, midi, audio_inputs, audio_outputs, supported_features)
+
+    view = self.views.get(key)
+    if view is None:
+      with self.lock:
+        view = self.build_view(*key)
+        self.views[key] = view
+    return view
+
+
+  def build_view(
+      self,
+      plugin_class,
+      midi,
+      audio_inputs,
+      audio_outputs,
+      supported_features,
+      ):
+    uris = set(self.plugins)
+
+    if plugin_class is not None:
+      uris &= self.by_class.get(plugin_class, set())
+    if midi is not None:
+      uris = uris & self.midi if midi else uris - self.midi
+    if audio_inputs is not None or audio_outputs is not None:
+      matching = set()
+      for (ins, outs), bucket in self.by_audio.items():
+        if audio_inputs not in (None, ins) or audio_outputs not in (None, outs):
+          continue
+        matching |= bucket
+      uris &= matching
+    if supported_features is not None:
+      for feature, bucket in self.by_feature.items():
+        if feature not in supported_features:
+          uris -= bucket
+
+    plugins = self.plugins
+    return tuple(sorted(
+        uris, key=lambda uri: (plugins[uri].name.lower(), uri)))
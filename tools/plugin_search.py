@@ -0,0 +1,254 @@
+#
+
+import collections
+import heapq
+import re
+import threading
+import time
+
+
+DEFAULT_LIMIT = 8
+# A bit under one frame at the UIs' frame rates.
+DEFAULT_BUDGET_SECONDS = 0.010
+
+# Tokens shorter than a trigram match word prefixes instead.
+PREFIX_LENGTH = 2
+
+PICKER_LETTERS = 'abcdefghijklmnopqrstuvwxyz0123456789 '
+
+
+def normalize(text):
+  # 'http://drobilla.net/plugins/mda/DX10' -> 'http drobilla net plugins mda dx10'
+  return ' '.join(re.split(r'[^0-9a-z]+', text.lower())).strip()
+
+
+def get_trigrams(token):
+  return set(token[i:i + 3] for i in range(len(token) - 2))
+
+
+class PluginSearch():
+  # Word prefix and trigram index over plugin names, URIs and authors.
+
+  def __init__(self, plugins=()):
+    self.lock = threading.Lock()
+
+    # {uri: normalized 'name uri author'}
+    self.texts = {}
+    # {uri: normalized name}
+    self.names = {}
+    # {prefix: set(uri)}, for the first PREFIX_LENGTH letters of every word.
+    self.prefixes = collections.defaultdict(set)
+    # {trigram: set(uri)}
+    self.trigrams = collections.defaultdict(set)
+
+    # Bumped on every change, so IncrementalSearch knows to start over.
+    self.generation = 0
+
+    self.add_plugins(plugins)
+
+
+  def add_plugins(self, plugins):
+    with self.lock:
+      for plugin in plugins:
+        name = normalize(plugin.name)
+        text = ' '.join([name, normalize(plugin.uri), normalize(plugin.author)])
+        self.names[plugin.uri] = name
+        self.texts[plugin.uri] = text
+        for word in text.split():
+          for n in range(1, PREFIX_LENGTH + 1):
+            self.prefixes[word[:n]].add(plugin.uri)
+          for trigram in get_trigrams(word):
+            self.trigrams[trigram].add(plugin.uri)
+      self.generation += 1
+
+
+  def match_token(self, token, candidates=None):
+    # URIs whose text contains token, short tokens only at word starts.
+    # candidates, if given, is a superset of the result to filter down.
+    with self.lock:
+      if len(token) <= PREFIX_LENGTH:
+        bucket = self.prefixes.get(token, set())
+        return bucket & candidates if candidates is not None else set(bucket)
+
+      if candidates is None:
+        buckets = sorted(
+            (self.trigrams.get(t, set()) for t in get_trigrams(token)), key=len)
+        candidates = set(buckets[0])
+        for bucket in buckets[1:]:
+          candidates &= bucket
+      # Trigrams can match across words or out of order, check the real text.
+      texts = self.texts
+      return set(uri for uri in candidates if token in texts[uri])
+
+
+  def match(self, query):
+    uris = None
+    for token in normalize(query).split():
+      uris = self.match_token(token, uris)
+    if uris is None:
+      with self.lock:
+        uris = set(self.texts)
+    return uris
+
+
+  def match_fuzzy(self, query):
+    # URIs sharing at least half of the query's trigrams, for typos.
+    counts = collections.Counter()
+    trigrams = set()
+    for token in normalize(query).split():
+      trigrams |= get_trigrams(token)
+    with self.lock:
+      for trigram in trigrams:
+        counts.update(self.trigrams.get(trigram, ()))
+    needed = (len(trigrams) + 1) // 2
+    return set(uri for uri, count in counts.items() if count >= needed)
+
+
+  def rank(self, query, uris, limit=DEFAULT_LIMIT, budget=DEFAULT_BUDGET_SECONDS):
+    # Name starts with the query, then a name word does, then the name
+    # contains it, then only the URI or author does; shorter names first.
+    # Returns the best limit URIs scored before the budget ran out.
+    query = normalize(query)
+    deadline = time.time() + budget
+    names = self.names
+
+    scored = []
+    for n, uri in enumerate(uris):
+      if n % 64 == 63 and time.time() > deadline:
+        break
+      name = names[uri]
+      if name.startswith(query):
+        rank = 0
+      elif (' ' + name).find(' ' + query) >= 0:
+        rank = 1
+      elif query in name:
+        rank = 2
+      else:
+        rank = 3
+      scored.append((rank, len(name), name, uri))
+
+    return [uri for rank, length, name, uri in heapq.nsmallest(limit, scored)]
+
+
+  def search(
+      self,
+      query,
+      limit=DEFAULT_LIMIT,
+      budget=DEFAULT_BUDGET_SECONDS,
+      within=None,
+      ):
+    uris = self.match(query)
+    if not uris:
+      uris = self.match_fuzzy(query)
+    if within is not None:
+      uris &= set(within)
+    return self.rank(query, uris, limit, budget)
+
+
+class IncrementalSearch():
+  # Search state for one input field. Each typed character narrows the
+  # previous query's matches instead of searching the whole catalogue.
+
+  def __init__(
+      self,
+      plugin_search,
+      limit=DEFAULT_LIMIT,
+      budget=DEFAULT_BUDGET_SECONDS,
+      ):
+    self.plugin_search = plugin_search
+    self.limit = limit
+    self.budget = budget
+
+    self.query = ''
+    # {query: set(uri)} for the query and every prefix of it.
+    self.matches = {}
+    self.generation = None
+
+
+  def type(self, text, within=None):
+    return self.set_query(self.query + text, within)
+
+
+  def backspace(self, within=None):
+    return self.set_query(self.query[:-1], within)
+
+
+  def clear(self):
+    self.query = ''
+    self.matches = {}
+
+
+  def set_query(self, query, within=None):
+    self.query = query
+    return self.get_results(within)
+
+
+  def get_results(self, within=None):
+    # Top hits for the current query, restricted to within if given.
+    plugin_search = self.plugin_search
+    if self.generation != plugin_search.generation:
+      # More plugins were discovered, cached matches are incomplete.
+      self.generation = plugin_search.generation
+      self.matches = {}
+
+    uris = self.get_matches(self.query)
+    if not uris:
+      uris = plugin_search.match_fuzzy(self.query)
+    if within is not None:
+      uris = uris & set(within)
+    return plugin_search.rank(self.query, uris, self.limit, self.budget)
+
+
+  def get_matches(self, query):
+    uris = self.matches.get(query)
+    if uris is not None:
+      return uris
+
+    previous = query[:-1]
+    uris = self.matches.get(previous) if query else None
+    if uris is not None:
+      tokens = normalize(query).split()
+      previous_tokens = normalize(previous).split()
+      if tokens == previous_tokens:
+        # Just a separator.
+        pass
+      elif tokens[:-1] == previous_tokens:
+        # A new token.
+        uris = self.plugin_search.match_token(tokens[-1], uris)
+      elif (len(tokens) == len(previous_tokens)
+            and tokens[:-1] == previous_tokens[:-1]
+            # A 2 letter word prefix match doesn't cover 3 letter substrings.
+            and len(previous_tokens[-1]) != PREFIX_LENGTH):
+        # The last token got longer.
+        uris = self.plugin_search.match_token(tokens[-1], uris)
+      else:
+        uris = None
+    if uris is None:
+      uris = self.plugin_search.match(query)
+
+    # Only keep the current query's line of prefixes.
+    self.matches = dict(
+        (q, m) for q, m in self.matches.items() if query.startswith(q))
+    self.matches[query] = uris
+    return uris
+
+
+class LetterPicker():
+  # Choose letters with an encoder or arrow keys, for UIs without a keyboard.
+
+  def __init__(self, letters=PICKER_LETTERS):
+    self.letters = letters
+    self.index = 0
+
+
+  def step(self, delta):
+    self.index = (self.index + delta) % len(self.letters)
+
+
+  def pick(self, fraction):
+    # Absolute encoders, fraction of the way along the alphabet.
+    self.index = min(int(fraction * len(self.letters)), len(self.letters) - 1)
+
+
+  def get_letter(self):
+    return self.letters[self.index]
@@ -0,0 +1,233 @@
+#
+
+import collections
+import logging
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# How long to wait for JACK to tell about a freshly added client's ports
+# before asking the server directly.
+DEFAULT_WAIT_SECONDS = 0.5
+
+
+# The parts of a jack.Port lookups need, kept after the port is gone.
+PortEntry = collections.namedtuple(
+    'PortEntry',
+    ['name', 'is_audio', 'is_midi', 'is_input', 'is_output', 'is_physical'],
+    )
+
+
+def get_port_entry(port):
+  return PortEntry(
+      name=port.name,
+      is_audio=port.is_audio,
+      is_midi=port.is_midi,
+      is_input=port.is_input,
+      is_output=port.is_output,
+      is_physical=port.is_physical,
+      )
+
+
+class PortRegistry():
+  # In-memory copy of the JACK graph, read once and then kept up to date by
+  # JACK's port registration, rename and connect callbacks. Has the same
+  # get_ports() and get_all_connections() as jack.Client, so it can stand in
+  # for it in lookups.
+  #
+  # Must be created before the client is activated, JACK only takes
+  # callbacks on inactive clients.
+
+  def __init__(self, jack_client):
+    self.jack_client = jack_client
+
+    self.lock = threading.Condition()
+    # {name: PortEntry}
+    self.ports = collections.OrderedDict()
+    # {name: set(name)}, both ends of every connection.
+    self.connections = collections.defaultdict(set)
+    # Set when a callback named a port that's already gone, the next lookup
+    # reads the whole graph again.
+    self.dirty = True
+    # Bumped on every change, for UIs that poll rather than listen, since
+    # listeners are called on JACK's thread.
+    self.changes = 0
+    # Called without arguments on every change, from JACK's thread.
+    self.listeners = []
+
+    # only_available=False, or removed ports would go unnoticed.
+    jack_client.set_port_registration_callback(
+        self.on_registration, only_available=False)
+    jack_client.set_port_rename_callback(self.on_rename, only_available=False)
+    jack_client.set_port_connect_callback(self.on_connect, only_available=False)
+
+
+  def refresh(self):
+    # Reads every port and connection from the server.
+    ports = collections.OrderedDict()
+    connections = collections.defaultdict(set)
+    for port in self.jack_client.get_ports():
+      ports[port.name] = get_port_entry(port)
+      for other in self.jack_client.get_all_connections(port):
+        connections[port.name].add(other.name)
+        connections[other.name].add(port.name)
+
+    with self.lock:
+      self.ports = ports
+      self.connections = connections
+      self.dirty = False
+      self.lock.notify_all()
+    self.notify()
+
+
+  def ensure_fresh(self):
+    if self.dirty:
+      self.refresh()
+
+
+  def get_ports(
+      self,
+      name_pattern='',
+      is_audio=False,
+      is_midi=False,
+      is_input=False,
+      is_output=False,
+      is_physical=False,
+      ):
+    # Like jack.Client.get_ports, name_pattern is a regular expression.
+    self.ensure_fresh()
+    pattern = re.compile(name_pattern)
+    with self.lock:
+      return [
+          port for port in self.ports.values()
+          if (pattern.search(port.name)
+              and (not is_audio or port.is_audio)
+              and (not is_midi or port.is_midi)
+              and (not is_input or port.is_input)
+              and (not is_output or port.is_output)
+              and (not is_physical or port.is_physical))
+          ]
+
+
+  def get_client_ports(self, client_name):
+    return self.get_ports('^' + re.escape(client_name) + ':')
+
+
+  def get_all_connections(self, port):
+    self.ensure_fresh()
+    name = getattr(port, 'name', port)
+    with self.lock:
+      return [
+          self.ports[other]
+          for other in sorted(self.connections.get(name, ()))
+          if other in self.ports
+          ]
+
+
+  def wait_for_clients(self, prefixes, timeout=DEFAULT_WAIT_SECONDS):
+    # Waits until each port name prefix has some ports, e.g. for a plugin
+    # mod-host just added. Falls back to asking the server after timeout.
+    self.ensure_fresh()
+    deadline = time.time() + timeout
+    with self.lock:
+      while True:
+        missing = [
+            prefix for prefix in prefixes
+            if not any(name.startswith(prefix) for name in self.ports)]
+        remaining = deadline - time.time()
+        if not missing or remaining <= 0:
+          break
+        self.lock.wait(remaining)
+    if missing:
+      logger.debug('No port callbacks for %s yet, re-reading', missing)
+      self.refresh()
+
+
+  def connect(self, source, destination):
+    # Records the connection straight away, the callback may be a while.
+    self.jack_client.connect(source, destination)
+    self.set_connected(
+        getattr(source, 'name', source),
+        getattr(destination, 'name', destination),
+        True)
+
+
+  def disconnect(self, source, destination):
+    self.jack_client.disconnect(source, destination)
+    self.set_connected(
+        getattr(source, 'name', source),
+        getattr(destination, 'name', destination),
+        False)
+
+
+  def set_connected(self, a, b, connected):
+    with self.lock:
+      if connected:
+        self.connections[a].add(b)
+        self.connections[b].add(a)
+      else:
+        self.connections[a].discard(b)
+        self.connections[b].discard(a)
+
+
+  def add_listener(self, listener):
+    self.listeners.append(listener)
+
+
+  def remove_listener(self, listener):
+    if listener in self.listeners:
+      self.listeners.remove(listener)
+
+
+  def notify(self):
+    self.changes += 1
+    for listener in list(self.listeners):
+      try:
+        listener()
+      except Exception as e:
+        logger.error('Port listener failed: %s', e)
+
+
+  # JACK callbacks. These run on JACK's notification thread and mustn't
+  # make requests to the server. Ports that are already gone come in as
+  # plain port ids, those mark the registry for a re-read.
+
+  def on_registration(self, port, register):
+    with self.lock:
+      if isinstance(port, int):
+        self.dirty = True
+      elif register:
+        self.ports[port.name] = get_port_entry(port)
+        self.lock.notify_all()
+      else:
+        self.ports.pop(port.name, None)
+        for other in self.connections.pop(port.name, ()):
+          self.connections[other].discard(port.name)
+    self.notify()
+
+
+  def on_rename(self, port, old, new):
+    with self.lock:
+      if isinstance(port, int) or old not in self.ports:
+        self.dirty = True
+      else:
+        self.ports[new] = self.ports.pop(old)._replace(name=new)
+        others = self.connections.pop(old, set())
+        self.connections[new] = others
+        for other in others:
+          self.connections[other].discard(old)
+          self.connections[other].add(new)
+    self.notify()
+
+
+  def on_connect(self, a, b, connect):
+    if isinstance(a, int) or isinstance(b, int):
+      with self.lock:
+        self.dirty = True
+    else:
+      self.set_connected(a.name, b.name, connect)
+    self.notify()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# mod-host names its JACK clients effect_<instance_number>.
+EFFECT_PREFIX = 'effect_'
+SYSTEM_PLAYBACK_PREFIX = 'system:playback_'
+# Where mod-host listens for the controls it maps itself (midi_map).
+MOD_HOST_MIDI_IN = 'mod-host:midi_in'
+
+
+def get_effect_ports(effect, ports):
+  return [port for port in ports if port.name.startswith(effect)]
+
+
+def get_desired_connections(
+    effects, effect_ports, midi_outs, playback_ins, control_ins=()):
+  # {(output_port_name, input_port_name)} for a rack of effects: every MIDI
+  # source into each effect's first MIDI input and into control_ins, and
+  # each effect's first and last audio outputs to the first two playback
+  # ports, so mono plugins play on both sides.
+  desired = set(
+      (midi_out.name, control_in.name)
+      for midi_out in midi_outs for control_in in control_ins)
+  for effect in effects:
+    ports = get_effect_ports(effect, effect_ports)
+
+    midi_ins = [p for p in ports if p.is_midi and p.is_input]
+    if midi_ins:
+      for midi_out in midi_outs:
+        desired.add((midi_out.name, midi_ins[0].name))
+
+    audio_outs = [p for p in ports if p.is_audio and p.is_output]
+    if audio_outs and len(playback_ins) >= 2:
+      desired.add((audio_outs[0].name, playback_ins[0].name))
+      desired.add((audio_outs[-1].name, playback_ins[1].name))
+    elif audio_outs:
+      logger.warning('No playback ports for %s', effect)
+  return desired
+
+
+def get_current_connections(graph, effect_ports):
+  # {(output_port_name, input_port_name)} touching any of the effect ports.
+  # graph is a jack.Client or a PortRegistry.
+  current = set()
+  for port in effect_ports:
+    for other in graph.get_all_connections(port):
+      if port.is_output:
+        current.add((port.name, other.name))
+      else:
+        current.add((other.name, port.name))
+  return current
+
+
+class Router():
+  # Declarative routing of mod-host effects. reconcile() looks at what's
+  # connected now and only makes the connects and disconnects needed to
+  # get to the wanted graph. Connections it made that are no longer wanted,
+  # e.g. of removed or standby plugins, are dropped. Connections made by
+  # anyone else, e.g. by hand in lil-tk's ports screen, are left alone.
+  #
+  # With a PortRegistry the graph is read from memory rather than queried
+  # from the JACK server every time.
+
+  def __init__(self, jack_client, midi_out='', registry=None, control_in=None):
+    self.jack_client = jack_client
+    # Name pattern of the MIDI sources to play the effects from.
+    self.midi_out = midi_out
+    # MIDI input the sources also go to, e.g. MOD_HOST_MIDI_IN.
+    self.control_in = control_in
+    self.registry = registry
+    self.graph = registry if registry else jack_client
+    # {(source, destination)} wanted by the last reconcile(), the only
+    # connections it may take down again.
+    self.owned = set()
+
+
+  def get_ports(self, effects):
+    graph = self.graph
+    if self.registry:
+      # mod-host may have only just added some of them.
+      self.registry.wait_for_clients(effects)
+    effect_ports = graph.get_ports(EFFECT_PREFIX)
+    midi_outs = [
+        port
+        for port in graph.get_ports(
+            self.midi_out, is_midi=True, is_output=True)
+        # Not from one plugin into the next.
+        if not port.name.startswith(EFFECT_PREFIX)
+        ]
+    playback_ins = graph.get_ports(
+        SYSTEM_PLAYBACK_PREFIX, is_audio=True, is_input=True)
+    control_ins = graph.get_ports(
+        self.control_in, is_midi=True, is_input=True) if self.control_in else []
+    return effect_ports, midi_outs, playback_ins, control_ins
+
+
+  def reconcile(self, effects, extra=()):
+    # effects: JACK client name prefixes, e.g. ['effect_0:', 'effect_3:'].
+    # extra: (source, destination) port names wanted on top of the default.
+    # Returns the number of connects and disconnects made.
+    effect_ports, midi_outs, playback_ins, control_ins = self.get_ports(effects)
+    desired = get_desired_connections(
+        effects, effect_ports, midi_outs, playback_ins, control_ins)
+    desired.update(tuple(c) for c in extra)
+    # The control inputs are ours to manage too.
+    current = get_current_connections(self.graph, effect_ports + control_ins)
+
+    changes = 0
+    # Connect first, a moment of both beats a moment of neither.
+    for source, destination in sorted(desired - current):
+      changes += self.apply(self.graph.connect, source, destination)
+    for source, destination in sorted((current - desired) & self.owned):
+      changes += self.apply(self.graph.disconnect, source, destination)
+    self.owned = desired
+    return changes
+
+
+  def get_extra_connections(self, effects):
+    # Connections of the effects that the default routing wouldn't make.
+    effect_ports, midi_outs, playback_ins, control_ins = self.get_ports(effects)
+    desired = get_desired_connections(
+        effects, effect_ports, midi_outs, playback_ins, control_ins)
+    current = get_current_connections(self.graph, effect_ports + control_ins)
+    return sorted(current - desired)
+
+
+  def apply(self, change, source, destination):
+    try:
+      change(source, destination)
+      return 1
+    except Exception as e:
+      # E.g. a port that went away since get_ports().
+      logger.warning('%s %s -> %s: %s', change.__name__, source, destination, e)
+      return 0
+
+
+if __name__ == '__main__':
+  import jack
+
+  parser = argparse.ArgumentParser(
+      description='Route mod-host effects to MIDI sources and system playback')
+  parser.add_argument('effects', nargs='+',
+                      help='effect client names, e.g. effect_0')
+  parser.add_argument('-m', '--midi_out', default='',
+                      help='name pattern of the MIDI sources')
+  parser.add_argument('-c', '--native_cc', action='store_true',
+                      help='also route the MIDI sources into mod-host\'s own '
+                      'MIDI input, for its midi_map mappings')
+  args = parser.parse_args()
+
+  logging.basicConfig()
+
+  jack_client = jack.Client('routing', no_start_server=True)
+  jack_client.activate()
+
+  changes = Router(
+      jack_client,
+      args.midi_out,
+      control_in=MOD_HOST_MIDI_IN if args.native_cc else None,
+      ).reconcile(
+      [effect.rstrip(':') + ':' for effect in args.effects])
+  print('{} changes'.format(changes))
+
+  jack_client.deactivate()
+  jack_client.close()
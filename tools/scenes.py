@@ -0,0 +1,122 @@
+#
+
+import json
+import logging
+import os
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+SCENES_VERSION = 1
+
+DEFAULT_SCENES_PATH = os.path.join(
+    os.getenv('XDG_CONFIG_HOME', '~/.config'), 'lil-t', 'scenes.json')
+
+
+# A scene, as made by Model.capture_scene():
+#   {
+#     'slots': {slot: {'url': url, 'params': {symbol: value}}},
+#     'connections': [[source, destination], ...],
+#   }
+# Only connections on top of the default routing (see routing.Router) are
+# kept. Ports of the rack's plugins are written '@<slot>:<port>', as the
+# mod-host instance behind a slot can change.
+
+SLOT_PORT_RE = re.compile(r'^@(\d+):(.*)$')
+EFFECT_PORT_RE = re.compile(r'^effect_(\d+):(.*)$')
+
+
+def to_slot_port(name, instance_slots):
+  # 'effect_100:left_out' -> '@0:left_out', None for plugins not in the rack.
+  match = EFFECT_PORT_RE.match(name)
+  if not match:
+    return name
+  slot = instance_slots.get(int(match.group(1)))
+  if slot is None:
+    return None
+  return '@{}:{}'.format(slot, match.group(2))
+
+
+def from_slot_port(name, get_effect_name):
+  # '@0:left_out' -> 'effect_100:left_out', with get_effect_name(slot).
+  match = SLOT_PORT_RE.match(name)
+  if not match:
+    return name
+  return get_effect_name(int(match.group(1))) + match.group(2)
+
+
+def get_port_slot(name):
+  match = SLOT_PORT_RE.match(name)
+  return int(match.group(1)) if match else None
+
+
+def normalize_scene(scene):
+  # JSON keys are strings, slots are ints everywhere else.
+  return {
+      'slots': dict(
+          (int(i), {'url': slot['url'], 'params': dict(slot.get('params', {}))})
+          for i, slot in scene.get('slots', {}).items()),
+      'connections': [tuple(c) for c in scene.get('connections', [])],
+      }
+
+
+class SceneStore():
+  # Named scenes in one JSON file.
+
+  def __init__(self, path=DEFAULT_SCENES_PATH):
+    self.path = os.path.expanduser(path)
+
+
+  def read(self):
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (IOError, OSError, ValueError):
+      return {}
+    if data.get('version') != SCENES_VERSION:
+      logger.warning('Ignoring scenes of version %s', data.get('version'))
+      return {}
+    return data.get('scenes', {})
+
+
+  def write(self, scenes):
+    scenes_dir = os.path.dirname(self.path)
+    if not os.path.isdir(scenes_dir):
+      os.makedirs(scenes_dir)
+    # Write aside and rename, a half-written file would lose every scene.
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(
+          {'version': SCENES_VERSION, 'scenes': scenes},
+          f,
+          separators=(',', ':'),
+          sort_keys=True,
+          )
+    os.rename(tmp_path, self.path)
+
+
+  def get_names(self):
+    return sorted(self.read())
+
+
+  def load(self, name):
+    scene = self.read().get(name)
+    return normalize_scene(scene) if scene is not None else None
+
+
+  def save(self, name, scene):
+    scenes = self.read()
+    scenes[name] = {
+        'slots': dict(
+            (str(i), slot) for i, slot in sorted(scene['slots'].items())),
+        'connections': [list(c) for c in scene.get('connections', [])],
+        }
+    self.write(scenes)
+
+
+  def delete(self, name):
+    scenes = self.read()
+    if scenes.pop(name, None) is not None:
+      self.write(scenes)
@@ -0,0 +1,148 @@
+#
+
+import collections
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+# Standby plugins get mod-host instance numbers from here up, well clear of
+# the rack slots.
+STANDBY_INSTANCE_BASE = 100
+
+
+class StandbyPool():
+  # Plugins instantiated in mod-host ahead of time but not routed anywhere,
+  # so loading one into a slot is a JACK reroute rather than a load.
+  # Also keeps the plugin a slot switched away from, with its param values,
+  # so switching back is just as quick.
+
+  def __init__(self, model, size):
+    self.model = model
+    self.size = size
+
+    # Shared with the model, which holds it from take() until the slot has
+    # its new instance and the old one is back here.
+    self.lock = model.instances_lock
+    # {instance_number: (url, {symbol: value})}, least recently used first.
+    self.instances = collections.OrderedDict()
+
+    # Only the newest preload request matters, older ones are dropped.
+    self.wanted = []
+    self.wakeup = threading.Event()
+
+    self.running = True
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def preload(self, urls):
+    with self.lock:
+      self.wanted = [url for url in urls if url]
+    self.wakeup.set()
+
+
+  def run(self):
+    while self.running:
+      self.wakeup.wait()
+      self.wakeup.clear()
+      if not self.running:
+        break
+      with self.lock:
+        wanted = list(self.wanted)
+      try:
+        self.load(wanted)
+      except Exception as e:
+        logger.warning('Preloading %s failed: %s', wanted, e)
+
+
+  def load(self, urls):
+    for url in urls:
+      with self.lock:
+        loaded = self.find(url) is not None
+      if loaded or url in self.model.plugins_slots.values():
+        continue
+
+      instance = self.evict_and_allocate(keep=urls)
+      if instance is None:
+        return
+      resp = self.model.wait_for_mod_host().add_plugin(url, instance)
+      logger.debug('Preloaded %s as %s: %s', url, instance, resp)
+      with self.lock:
+        self.instances[instance] = (url, {})
+
+
+  def evict_and_allocate(self, keep):
+    # Makes room for one more, dropping the least recently used standby
+    # that isn't wanted right now. Returns None if the pool is all wanted.
+    with self.lock:
+      evicted = None
+      if len(self.instances) >= self.size:
+        for instance, (url, params) in self.instances.items():
+          if url not in keep:
+            evicted = instance
+            break
+        if evicted is None:
+          return None
+        del self.instances[evicted]
+      instance = self.allocate()
+
+    if evicted is not None:
+      self.model.wait_for_mod_host().remove_plugin(evicted)
+    return instance
+
+
+  def allocate(self):
+    # Called with the lock held.
+    used = set(self.instances)
+    used.update(self.model.slot_instances.values())
+    instance = STANDBY_INSTANCE_BASE
+    while instance in used:
+      instance += 1
+    return instance
+
+
+  def find(self, url):
+    for instance, (standby_url, params) in self.instances.items():
+      if standby_url == url:
+        return instance
+    return None
+
+
+  def take(self, url):
+    # Returns (instance_number, {symbol: value}) of a loaded standby for url
+    # and hands it over to the caller, or None.
+    with self.lock:
+      instance = self.find(url)
+      if instance is None:
+        return None
+      url, params = self.instances.pop(instance)
+      return (instance, params)
+
+
+  def put(self, instance, url, params):
+    # Takes in an instance just switched away from. Returns the instance
+    # numbers that no longer fit, for the caller to remove from mod-host.
+    with self.lock:
+      self.instances[instance] = (url, params)
+      evicted = []
+      while len(self.instances) > self.size:
+        old_instance, old = self.instances.popitem(last=False)
+        evicted.append(old_instance)
+      return evicted
+
+
+  def clear(self):
+    # Returns the instance numbers that were held.
+    with self.lock:
+      instances = list(self.instances)
+      self.instances.clear()
+      return instances
+
+
+  def stop(self):
+    self.running = False
+    self.wakeup.set()
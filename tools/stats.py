@@ -0,0 +1,7 @@
+#
+
+
+def percentile(samples, p):
+  # Nearest rank, p from 0 to 100.
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
@@ -0,0 +1,67 @@
+#
+
+import logging
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+MIN_BACKOFF_SECONDS = 0.1
+MAX_BACKOFF_SECONDS = 0.5
+
+
+class ModHostSupervisor():
+
+  def __init__(
+      self,
+      model,
+      min_backoff=MIN_BACKOFF_SECONDS,
+      max_backoff=MAX_BACKOFF_SECONDS,
+      ):
+    self.model = model
+    self.min_backoff = min_backoff
+    self.max_backoff = max_backoff
+
+    self.disconnected = threading.Event()
+    self.model.mod_host.add_disconnect_listener(self.disconnected.set)
+
+    self.running = True
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def run(self):
+    while self.running:
+      self.disconnected.wait()
+      self.disconnected.clear()
+      if not self.running:
+        break
+
+      if self.reconnect():
+        start = time.time()
+        self.model.replay_rack()
+        logger.info('Rack restored in %.0f ms', 1000 * (time.time() - start))
+
+
+  def reconnect(self):
+    # mod-host.service restarts mod-host a few seconds after it dies, keep
+    # knocking until it's back.
+    backoff = self.min_backoff
+    while self.running:
+      try:
+        self.model.mod_host.reconnect()
+        return True
+      except socket.error as e:
+        logger.debug('mod-host not back yet: %s', e)
+      time.sleep(backoff)
+      backoff = min(backoff * 2, self.max_backoff)
+    return False
+
+
+  def stop(self):
+    self.running = False
+    self.disconnected.set()
@@ -0,0 +1,37 @@
+#
+
+from array import array
+
+
+class SymbolTable():
+
+  def __init__(self, symbols):
+    # symbols: [(symbol, default_val, min_val, max_val), ...]
+    self.symbols = [symbol for symbol, default_val, min_val, max_val in symbols]
+    self.defaults = array('d', [s[1] for s in symbols])
+    self.mins = array('d', [s[2] for s in symbols])
+    self.maxs = array('d', [s[3] for s in symbols])
+    self.index = dict((symbol, i) for i, symbol in enumerate(self.symbols))
+
+
+  def __len__(self):
+    return len(self.symbols)
+
+
+  def __getitem__(self, i):
+    # Same (symbol, default_val, min_val, max_val) tuples as util.get_symbols.
+    return (self.symbols[i], self.defaults[i], self.mins[i], self.maxs[i])
+
+
+  def __iter__(self):
+    for i in range(len(self.symbols)):
+      yield self[i]
+
+
+  def get_index(self, symbol):
+    return self.index[symbol]
+
+
+  def scale(self, i, fraction):
+    # Maps 0..1 onto the port's range.
+    return self.mins[i] + (self.maxs[i] - self.mins[i]) * fraction
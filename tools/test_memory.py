@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import gc
+
+from plugin_cache import load_plugins
+from util import get_plugins
+
+
+def get_rss_kb():
+  with open('/proc/self/status') as f:
+    for line in f:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1])
+  return 0
+
+
+def test_memory(use_lilv=False):
+  # Run once per mode, RSS doesn't shrink back reliably within one process.
+  gc.collect()
+  before = get_rss_kb()
+
+  if use_lilv:
+    print('Loading plugins with lilv, World kept alive..')
+    plugins, plugin_map = get_plugins()
+  else:
+    print('Loading plugins from the cache, scanning in a child process..')
+    plugins, plugin_map = load_plugins(isolated=True)
+
+  gc.collect()
+  after = get_rss_kb()
+
+  print('Plugins: {} ({} MIDI)'.format(len(plugins), len(plugin_map)))
+  print('RSS before: {:>8} kB'.format(before))
+  print('RSS after:  {:>8} kB'.format(after))
+  print('Growth:     {:>8} kB'.format(after - before))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Resident memory of plugin discovery')
+  parser.add_argument('--lilv', action='store_true',
+                      help='load through util.get_plugins instead of the cache')
+  args = parser.parse_args()
+
+  test_memory(args.lilv)
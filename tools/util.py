@@ -5,6 +5,7 @@ from __future__ import print_function
 import logging
 
 import socket
+import threading
 
 from lilv import World
 from lilv import Plugin
@@ -24,19 +25,39 @@ logger = logging.getLogger(__name__)
 
 class ModHostConnection():
 
-  def __init__(self):
+  def __init__(self, host='localhost', port=5555, feedback_port=5556):
+    self.host = host
+    self.port = port
+    self.feedback_port = feedback_port
+    # Shared by the UI and background writers, a batch must not interleave.
+    self.lock = threading.Lock()
     self.to_modhost_socket, self.from_modhost_socket = self.get_mod_host_sockets()
+    self.reader = FrameReader(self.to_modhost_socket)
+    # Replies still to come for commands that timed out, skipped before the
+    # next batch's so every reply goes to its own command.
+    self.owed = 0
+    self.feedback = None
+    self.connected = True
+    # Called (without arguments) once when the connection is found dead.
+    self.disconnect_listeners = []
 
 
   def get_mod_host_sockets(self):
-    to_modhost_socket = self.open_socket(port=5555)
-    from_modhost_socket = self.open_socket(port=5556)
+    to_modhost_socket = self.open_socket(self.host, self.port)
+    try:
+      from_modhost_socket = self.open_socket(self.host, self.feedback_port)
+    except socket.error:
+      # Half a connection is no use, e.g. to reconnect() trying again.
+      to_modhost_socket.close()
+      raise
     return (to_modhost_socket, from_modhost_socket)
 
 
   def open_socket(self, host='localhost', port=5555):
     new_socket = socket.socket()
     new_socket.settimeout(5)
+    # Commands are tiny, don't let Nagle hold them back waiting for ACKs.
+    new_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     try:
       new_socket.connect((host, port))
     except socket.error as e:
@@ -49,43 +70,106 @@ class ModHostConnection():
     return new_socket
 
 
-  def send_command(self, command, encoding='utf-8'):
-    assert self.to_modhost_socket
-    assert self.from_modhost_socket
+  def start_feedback_listener(self):
+    # Read mod-host's asynchronous notifications from the feedback socket.
+    if not self.feedback:
+      self.feedback = ModHostFeedbackListener(self.from_modhost_socket)
+      self.feedback.subscribe(self.on_feedback)
+    return self.feedback
 
-    if not type(command) == bytes:
-      command = bytes(command, encoding)
 
-    self.to_modhost_socket.send(command)
+  def on_feedback(self, name, args):
+    # The feedback socket sees a mod-host restart first, even when idle.
+    if name == 'disconnected':
+      self.handle_disconnect()
 
-    logger.debug('sent: %s', command)
 
-    resp = None
+  def add_disconnect_listener(self, listener):
+    self.disconnect_listeners.append(listener)
 
-    try:
-      resp = self.to_modhost_socket.recv(1024)
-      if resp:
-        logger.debug('resp: %s', resp)
-    except Exception:
-      return None
 
-    # try:
-    #   resp = self.from_modhost_socket.recv(1024)
-    #   if resp:
-    #     logging.debug('resp: %s', resp)
-    # except Exception:
-    #   return None
+  def handle_disconnect(self):
+    if not self.connected:
+      return
+    self.connected = False
+    logger.error('Lost connection to mod-host')
+    for listener in list(self.disconnect_listeners):
+      listener()
+
 
-    resp = resp.decode(encoding)
+  def reconnect(self):
+    # Raises socket.error while mod-host is still down.
+    to_modhost_socket, from_modhost_socket = self.get_mod_host_sockets()
 
-    resp = resp.strip('\x00')
-    if resp.startswith('resp '):
-      resp_parts = resp.split(' ')
-      if len(resp_parts) > 2:
-        return (int(resp_parts[1]), float(resp_parts[2]))
-      return (int(resp_parts[1]), None)
+    with self.lock:
+      for old_socket in [self.to_modhost_socket, self.from_modhost_socket]:
+        old_socket.close()
+      self.to_modhost_socket = to_modhost_socket
+      self.from_modhost_socket = from_modhost_socket
+      self.reader = FrameReader(self.to_modhost_socket)
+      self.owed = 0
 
-    return (None, resp)
+      if self.feedback:
+        self.feedback.stop()
+        self.feedback = ModHostFeedbackListener(
+            self.from_modhost_socket,
+            subscribers=self.feedback.subscribers,
+            )
+
+      self.connected = True
+
+    logger.info('Reconnected to mod-host')
+
+
+  def send_command(self, command, encoding='utf-8'):
+    return self.send_commands([command], encoding)[0]
+
+
+  def send_commands(self, commands, encoding='utf-8'):
+    assert self.to_modhost_socket
+    assert self.from_modhost_socket
+
+    # Pipeline: write every command back-to-back, then collect the responses
+    # afterwards. mod-host answers in order, so a whole batch costs about one
+    # round-trip instead of one per command.
+    commands = list(commands)
+    payload = b''.join(encode_command(c, encoding) for c in commands)
+
+    responses = []
+    disconnected = False
+
+    with self.lock:
+      try:
+        self.to_modhost_socket.sendall(payload)
+
+        logger.debug('sent: %s', payload)
+
+        while self.owed:
+          self.reader.next_frame()
+          self.owed -= 1
+        for _ in commands:
+          try:
+            responses.append(self.reader.read_response(encoding))
+          except (ValueError, UnicodeDecodeError) as e:
+            # The frame is used up, the next one is the next command's.
+            logger.error('Bad response from mod-host: %s', e)
+            responses.append(None)
+      except socket.timeout:
+        # The rest of the replies may still come, partial frames stay in the
+        # reader.
+        self.owed += len(commands) - len(responses)
+      except socket.error as e:
+        logger.error('mod-host command failed: %s', e)
+        self.reader.reset()
+        self.owed = 0
+        disconnected = True
+
+    responses.extend([None] * (len(commands) - len(responses)))
+
+    if disconnected:
+      self.handle_disconnect()
+
+    return responses
 
 
   def add_plugin(self, plugin_uri, instance_number=0):
@@ -96,6 +180,11 @@ class ModHostConnection():
     self.send_command('remove {}'.format(instance_number))
 
 
+  def remove_plugins(self, instance_numbers):
+    return self.send_commands(
+        'remove {}'.format(i) for i in instance_numbers)
+
+
   def get_presets(self, URI):
     return self.send_command('preset_show {}'.format(URI))
 
@@ -105,13 +194,236 @@ class ModHostConnection():
     return self.send_command('param_get {} {}'.format(instance_number, symbol))
 
 
+  def get_params(self, params):
+    # params: iterable of (instance_number, symbol).
+    return self.send_commands(
+        'param_get {} {}'.format(instance_number, symbol)
+        for instance_number, symbol in params)
+
+
   def set_param(self, instance_number, symbol, value):
     logger.debug('set_param {} {} {}'.format(instance_number, symbol, value))
     return self.send_command('param_set {} {} {}'.format(instance_number, symbol, value))
 
 
+  def set_params(self, params):
+    # params: iterable of (instance_number, symbol, value), sent as one batch.
+    return self.send_commands(
+        'param_set {} {} {}'.format(instance_number, symbol, value)
+        for instance_number, symbol, value in params)
+
+
+def encode_command(command, encoding='utf-8'):
+  if not isinstance(command, bytes):
+    command = command.encode(encoding)
+  # mod-host commands are NUL-terminated C strings, which is also what lets
+  # several of them share one write.
+  return command + b'\x00'
+
+
+RESP_PREFIX = b'resp '
+
+
+def parse_response(resp, encoding='utf-8'):
+  resp = resp.rstrip(b'\x00')
+  return parse_response_frame(resp, memoryview(resp), 0, len(resp), encoding)
+
+
+def parse_response_frame(buffer, view, start, end, encoding='utf-8'):
+  # Parses 'resp <status> [<value>]' straight out of the receive buffer,
+  # copying out only the numbers. tobytes() rather than bytes(), which on
+  # Python 2 gives the view's repr.
+  if view[start:start + len(RESP_PREFIX)] == RESP_PREFIX:
+    status_start = start + len(RESP_PREFIX)
+    status_end = buffer.find(b' ', status_start, end)
+    if status_end < 0:
+      return (int(view[status_start:end].tobytes()), None)
+    value_end = buffer.find(b' ', status_end + 1, end)
+    if value_end < 0:
+      value_end = end
+    return (
+        int(view[status_start:status_end].tobytes()),
+        float(view[status_end + 1:value_end].tobytes()),
+        )
+
+  return (None, view[start:end].tobytes().decode(encoding))
+
+
+class FrameReader():
+
+  def __init__(self, sock, size=1024):
+    self.sock = sock
+    # Received bytes live in [start, end) of one reusable buffer.
+    self.buffer = bytearray(size)
+    self.view = memoryview(self.buffer)
+    self.start = 0
+    self.end = 0
+
+
+  def reset(self):
+    self.start = 0
+    self.end = 0
+
+
+  def next_frame(self):
+    # Returns the offsets of the next NUL-terminated frame in self.buffer,
+    # only valid until the next call. Partial frames stay buffered, also when
+    # recv times out, and replies that arrived together are handed out one
+    # at a time without another recv.
+    while True:
+      nul = self.buffer.find(b'\x00', self.start, self.end)
+      if nul >= 0:
+        frame = (self.start, nul)
+        self.start = nul + 1
+        return frame
+
+      self.compact()
+      received = self.sock.recv_into(self.view[self.end:])
+      if not received:
+        raise socket.error('mod-host closed the connection')
+      self.end += received
+
+
+  def compact(self):
+    if self.start == self.end:
+      self.start = self.end = 0
+    elif self.start:
+      remaining = self.end - self.start
+      self.view[:remaining] = self.view[self.start:self.end]
+      self.start, self.end = 0, remaining
+
+    if self.end == len(self.buffer):
+      # A frame longer than the buffer, e.g. a big preset list.
+      self.buffer = self.buffer + bytearray(len(self.buffer))
+      self.view = memoryview(self.buffer)
+
+
+  def read_frame(self):
+    start, end = self.next_frame()
+    return self.view[start:end].tobytes()
+
+
+  def read_response(self, encoding='utf-8'):
+    start, end = self.next_frame()
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug('resp: %s', self.view[start:end].tobytes())
+    return parse_response_frame(self.buffer, self.view, start, end, encoding)
+
+
+# Argument types of the messages mod-host pushes out on its feedback port.
+FEEDBACK_MESSAGE_TYPES = {
+  'param_set': (int, str, float), # instance, symbol, value
+  'output_set': (int, str, float), # instance, symbol, value
+  # instance, symbol, channel, controller, value, minimum, maximum
+  'midi_mapped': (int, str, int, int, float, float, float),
+  'midi_program_change': (int, int), # program, channel
+  'transport': (int, float, float), # rolling, beats per bar, bpm
+}
+
+
+def parse_feedback_message(message, encoding='utf-8'):
+  parts = message.decode(encoding).strip('\x00').split(' ')
+  name, args = parts[0], parts[1:]
+  arg_types = FEEDBACK_MESSAGE_TYPES.get(name)
+  if arg_types and len(args) == len(arg_types):
+    args = [t(a) for t, a in zip(arg_types, args)]
+  return (name, tuple(args))
+
+
+class ModHostFeedbackListener():
+
+  def __init__(self, feedback_socket, subscribers=None):
+    self.feedback_socket = feedback_socket
+    self.reader = FrameReader(feedback_socket)
+
+    # Latest values pushed by mod-host, {(instance, symbol): value}.
+    self.lock = threading.Lock()
+    self.params = {}
+    self.outputs = {}
+    self.subscribers = list(subscribers) if subscribers else []
+
+    self.running = True
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+
+  def subscribe(self, callback):
+    # callback(name, args) is called on the listener thread.
+    with self.lock:
+      self.subscribers.append(callback)
+
+
+  def unsubscribe(self, callback):
+    with self.lock:
+      self.subscribers.remove(callback)
+
+
+  def get_param(self, instance_number, symbol):
+    with self.lock:
+      return self.params.get((instance_number, symbol))
+
+
+  def get_output(self, instance_number, symbol):
+    with self.lock:
+      return self.outputs.get((instance_number, symbol))
+
+
+  def run(self):
+    while self.running:
+      try:
+        message = self.reader.read_frame()
+      except socket.timeout:
+        continue
+      except socket.error as e:
+        if not self.running:
+          break
+        logger.error('Feedback socket closed: %s', e)
+        self.running = False
+        self.dispatch('disconnected', ())
+        break
+
+      if message:
+        logger.debug('feedback: %s', message)
+        try:
+          name, args = parse_feedback_message(message)
+        except (ValueError, UnicodeDecodeError) as e:
+          # One bad frame mustn't stop the values coming.
+          logger.error('Bad feedback %r: %s', message, e)
+          continue
+        self.dispatch(name, args)
+
+
+  def dispatch(self, name, args):
+    with self.lock:
+      if name == 'param_set' and len(args) == 3:
+        self.params[(args[0], args[1])] = args[2]
+      elif name == 'output_set' and len(args) == 3:
+        self.outputs[(args[0], args[1])] = args[2]
+      elif name == 'midi_mapped' and len(args) == 7:
+        self.params[(args[0], args[1])] = args[4]
+      subscribers = list(self.subscribers)
+
+    for callback in subscribers:
+      try:
+        callback(name, args)
+      except Exception as e:
+        logger.error('Feedback subscriber failed: %s', e)
+
+
+  def stop(self):
+    self.running = False
+
+
 # LV2 utils
 
+LV2_INPUT_PORT = 'http://lv2plug.in/ns/lv2core#InputPort'
+LV2_OUTPUT_PORT = 'http://lv2plug.in/ns/lv2core#OutputPort'
+LV2_AUDIO_PORT = 'http://lv2plug.in/ns/lv2core#AudioPort'
+LV2_ATOM_PORT = 'http://lv2plug.in/ns/ext/atom#AtomPort'
+LV2_EVENT_PORT = 'http://lv2plug.in/ns/ext/event#EventPort'
+
+
 def get_plugins():
   world = World()
   world.load_all()
@@ -138,12 +450,45 @@ def is_midi_plugin(plugin):
 
 
 def is_midi_port(port):
-  for c in port.get_classes():
-    if str(c) == 'http://lv2plug.in/ns/lv2core#InputPort':
-      return True
-    elif str(c) == 'http://lv2plug.in/ns/ext/atom#AtomPort':
-      return True
-  return False
+  return is_midi_input(get_port_classes(port))
+
+
+def get_port_classes(port):
+  # Stringify each class URI once, then test membership.
+  return frozenset(str(c) for c in port.get_classes())
+
+
+def is_midi_input(port_classes):
+  # An event input, rather than any input port at all.
+  return LV2_INPUT_PORT in port_classes and (
+      LV2_ATOM_PORT in port_classes or LV2_EVENT_PORT in port_classes)
+
+
+def is_audio_input(port_classes):
+  return LV2_INPUT_PORT in port_classes and LV2_AUDIO_PORT in port_classes
+
+
+def is_audio_output(port_classes):
+  return LV2_OUTPUT_PORT in port_classes and LV2_AUDIO_PORT in port_classes
+
+
+def get_class_parents(world):
+  # {class_uri: parent_class_uri}, from the classes lilv knows about.
+  parents = {}
+  for plugin_class in world.get_plugin_classes():
+    parent = plugin_class.get_parent_uri()
+    parents[str(plugin_class.get_uri())] = str(parent) if parent else None
+  return parents
+
+
+def get_class_ancestry(plugin_class, class_parents):
+  # The class itself followed by all its superclasses, e.g.
+  # [InstrumentPlugin, GeneratorPlugin, Plugin].
+  ancestry = []
+  while plugin_class and plugin_class not in ancestry:
+    ancestry.append(plugin_class)
+    plugin_class = class_parents.get(plugin_class)
+  return ancestry
 
 
 def get_ports(plugin):
@@ -169,13 +514,17 @@ def get_symbols(plugin):
 # Mido MIDI utils
 
 def add_midi_event_listener(event_handler):
-  # Add handler for all incoming MIDI messages.
+  # Add handler for all incoming MIDI messages. It runs on mido's input
+  # threads, so should be quick, e.g. MidiDispatcher.put.
+  input_ports = []
   midi_input_names = mido.get_input_names()
   for midi_input_name in midi_input_names:
-    input_port = mido.open_input(
+    input_ports.append(mido.open_input(
         midi_input_name,
-        callback=lambda message: event_handler(midi_input_name, message),
-        )
+        callback=lambda message, name=midi_input_name: event_handler(
+            name, message),
+        ))
+  return input_ports
 
 
 # jack_client JACK utils
@@ -204,54 +553,3 @@ def get_connections(jack_client, port):
 
 def get_all_ports(jack_client):
   return jack_client.get_ports()
-
-
-def connect_effect(jack_client, effect='', midi_out=''):
-  midi_in_ports = jack_client.get_ports(
-      effect,
-      is_midi=True,
-      is_input=True,
-      )
-
-  audio_out_ports = jack_client.get_ports(
-      effect,
-      is_audio=True,
-      is_output=True,
-      )
-
-  midi_out_ports = jack_client.get_ports(
-      midi_out,
-      is_midi=True,
-      is_output=True,
-      )
-
-  audio_in_ports = jack_client.get_ports(
-      'system:',
-      is_audio=True,
-      is_input=True,
-      )
-
-  try:
-    jack_client.connect(
-        audio_out_ports[0],
-        audio_in_ports[0],
-        )
-  except Exception as e:
-    logger.warning(e)
-
-  try:
-    jack_client.connect(
-        audio_out_ports[1],
-        audio_in_ports[1],
-        )
-  except Exception as e:
-    logger.warning(e)
-
-  for midi_out_port in midi_out_ports:
-    try:
-      jack_client.connect(
-          midi_out_port,
-          midi_in_ports[0],
-          )
-    except Exception as e:
-      logger.warning(e)